@@ -0,0 +1,6 @@
+"""
+Benchmarks of hammocking on synthetic C projects.
+
+    python -m benchmarks run --sizes small medium --output results.json
+    python -m benchmarks compare baseline.json results.json
+"""
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+from argparse import ArgumentParser, ArgumentTypeError
+from dataclasses import replace
+from pathlib import Path
+
+from .project import SIZES, SyntheticProject
+from .suite import run_suite, compare, load
+
+
+MINIMUM = {"depth": 1, "sources": 1}  # The other sizes can be 0
+
+
+def at_least(minimum: int):
+    """Argument type of a number that must not be below the minimum"""
+    def number(value: str) -> int:
+        if int(value) < minimum:
+            raise ArgumentTypeError(f"must be at least {minimum}")
+        return int(value)
+    return number
+
+
+def main(pargv) -> int:
+    arg = ArgumentParser(prog="python -m benchmarks", description="Benchmarks of hammocking on synthetic C projects")
+    commands = arg.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="Generate and build a synthetic project")
+    generate.add_argument("directory", type=Path)
+    generate.add_argument("--size", choices=sorted(SIZES), default="small", help="Size to start from")
+    run = commands.add_parser("run", help="Time all stages on projects of several sizes")
+    run.add_argument("--sizes", nargs="+", choices=sorted(SIZES), default=["small", "medium"])
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--output", "-o", type=Path, help="JSON file for the results")
+    run.add_argument("--workdir", type=Path, help="Keep the generated projects in this directory")
+    for command in [generate, run]:
+        for field in ["headers", "declarations", "depth", "structs", "function_pointers", "undefined", "sources", "seed"]:
+            command.add_argument(f"--{field.replace('_', '-')}", type=int if field == "seed" else at_least(MINIMUM.get(field, 0)),
+                                 help=f"Override the number of {field.replace('_', ' ')}")
+    compare_ = commands.add_parser("compare", help="Compare the results of two runs")
+    compare_.add_argument("baseline", type=Path)
+    compare_.add_argument("results", type=Path)
+    compare_.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as regression")
+    args = arg.parse_args(pargv)
+
+    if args.command == "compare":
+        regressions = compare(load(args.baseline), load(args.results), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions above {args.threshold:.0%}", file=sys.stderr)
+            return 1
+        return 0
+
+    overrides = {field: value for field in ["headers", "declarations", "depth", "structs", "function_pointers", "undefined",
+                                            "sources", "seed"] if (value := getattr(args, field)) is not None}
+    if args.command == "generate":
+        project = SyntheticProject(args.directory, replace(SIZES[args.size], **overrides)).generate()
+        print(project.build())
+        return 0
+    sizes = {name: replace(SIZES[name], **overrides) for name in args.sizes}
+    results = run_suite(sizes, args.repeat, args.workdir)
+    output = json.dumps(results, indent=1)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
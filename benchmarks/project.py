@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import random
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from subprocess import run
+from typing import List
+
+
+@dataclass
+class ProjectSize:
+    headers: int = 10
+    declarations: int = 50  # Per header, alternating functions and variables
+    depth: int = 2  # Length of the include chains
+    structs: int = 2  # Struct types per header
+    function_pointers: int = 2  # Function pointer types per header
+    undefined: int = 50  # Symbols used by the sources, i.e. to be mocked
+    sources: int = 1
+    seed: int = 0
+
+
+SIZES = {
+    "small": ProjectSize(),
+    "medium": ProjectSize(headers=50, declarations=200, depth=4, undefined=500, sources=5),
+    "large": ProjectSize(headers=200, declarations=500, depth=8, structs=4, function_pointers=4, undefined=5000, sources=20),
+}
+
+
+class SyntheticProject:
+    """
+    A generated C project: headers with struct, function pointer, function and variable declarations
+    in include chains, sources using some of them, and the partially linked object of the sources.
+    """
+
+    def __init__(self, root: Path, size: ProjectSize) -> None:
+        self.root = Path(root)
+        self.size = size
+        self.include_dir = self.root / "include"
+        self.sources: List[Path] = []
+        self.symbols: List[str] = []
+        self.plink = self.root / "prod.o"
+
+    @property
+    def args(self) -> List[str]:
+        return [f"-I{self.include_dir}"]
+
+    def generate(self) -> "SyntheticProject":
+        self.include_dir.mkdir(parents=True, exist_ok=True)
+        declared = []
+        for header in range(self.size.headers):
+            declared += self.write_header(header)
+        rng = random.Random(self.size.seed)
+        self.symbols = sorted(rng.sample(declared, min(self.size.undefined, len(declared))))
+        for index in range(self.size.sources):
+            self.sources.append(self.write_source(index, self.symbols[index::self.size.sources]))
+        return self
+
+    def write_header(self, header: int) -> List[str]:
+        """Write a header and return the names it declares"""
+        lines = [f"#ifndef h{header}_h", f"#define h{header}_h", ""]
+        if header % self.size.depth:
+            lines += [f'#include "h{header - 1}.h"', ""]
+        for struct in range(self.size.structs):
+            lines += [f"typedef struct s{header}_{struct} {{",
+                      "    int a;",
+                      "    double b[4];",
+                      f"    struct s{header}_{struct} *next;",
+                      f"}} s{header}_{struct}_t;"]
+        for pointer in range(self.size.function_pointers):
+            lines.append(f"typedef int (*cb{header}_{pointer}_t)(int, const s{header}_{pointer % max(self.size.structs, 1)}_t *);"
+                         if self.size.structs else f"typedef int (*cb{header}_{pointer}_t)(int, void *);")
+        lines.append("")
+        names = []
+        for index in range(self.size.declarations):
+            struct = f"s{header}_{index % self.size.structs}_t" if self.size.structs else "int"
+            pointer = f"cb{header}_{index % self.size.function_pointers}_t" if self.size.function_pointers else "void *"
+            name = f"h{header}_d{index}"
+            lines.append([
+                f"int {name}(int a, const {struct} *s);",
+                f"extern int {name};",
+                f"void {name}({pointer} cb, unsigned char buffer[8]);",
+                f"extern const {struct} {name};",
+                f"{struct} {name}(void);",
+                f"extern {pointer} {name};",
+                f"double {name}(float, ...);",
+                f"extern char {name}[16];",
+            ][index % 8])
+            names.append(name)
+        lines += ["", f"#endif /* h{header}_h */", ""]
+        (self.include_dir / f"h{header}.h").write_text("\n".join(lines))
+        return names
+
+    def write_source(self, index: int, symbols: List[str]) -> Path:
+        headers = sorted({int(symbol[1:symbol.index("_")]) for symbol in symbols})
+        lines = [f'#include "h{header}.h"' for header in headers]
+        lines += ["", f"const void *used{index}[] = {{"] + [f"    (const void *)&{symbol}," for symbol in symbols] + ["};", ""]
+        source = self.root / f"source{index}.c"
+        source.write_text("\n".join(lines))
+        return source
+
+    def build(self, compiler: str = os.environ.get("CC", "cc")) -> Path:
+        """Compile the sources and link them partially, like a production object to be tested"""
+        objects = []
+        for source in self.sources:
+            objects.append(source.with_suffix(".o"))
+            run([compiler, "-c", "-w", *self.args, "-o", str(objects[-1]), str(source)], check=True)
+        run([compiler, "-r", "-nostdlib", "-o", str(self.plink), *map(str, objects)], check=True)
+        return self.plink
+
+    def describe(self) -> dict:
+        return asdict(self.size)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from hammocking.hammocking import ConfigReader, LibClang, Hammock, NmWrapper, MockupWriter
+from .project import SyntheticProject, ProjectSize
+
+REPOSITORY = Path(__file__).parent.parent
+
+
+def measure(function: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> dict:
+    """Wall time of the function in seconds, with the setup excluded"""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+class Benchmark:
+    """Times the stages of hammocking and the whole run on one synthetic project"""
+
+    def __init__(self, project: SyntheticProject, repeat: int = 3) -> None:
+        self.project = project
+        self.repeat = repeat
+        self.outdir = project.root / "out"
+
+    def read(self, combine: bool = False) -> Hammock:
+        hammock = Hammock(set(self.project.symbols), self.project.args)
+        hammock.combine = combine
+        hammock.read(self.project.sources)
+        assert hammock.done, f"Not mocked: {hammock.symbols}"
+        return hammock
+
+    def clean_outdir(self) -> None:
+        shutil.rmtree(self.outdir, ignore_errors=True)
+        self.outdir.mkdir()
+
+    @staticmethod
+    def python(*arguments: str) -> None:
+        environment = dict(os.environ, PYTHONPATH=os.pathsep.join([str(REPOSITORY), os.environ.get("PYTHONPATH", "")]))
+        subprocess.run([sys.executable, *arguments], check=True, env=environment, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    def end_to_end(self, *options: str) -> None:
+        self.python("-m", "hammocking", "--plink", str(self.project.plink), "--sources", *map(str, self.project.sources),
+                    "--outdir", str(self.outdir), *options, *self.project.args)
+
+    def run(self) -> Dict[str, dict]:
+        hammock = self.read()
+        stages = {
+            "nm": measure(lambda: NmWrapper(self.project.plink).get_undefined_symbols(), self.repeat),
+            "read": measure(self.read, self.repeat),
+            "read_combined": measure(lambda: self.read(combine=True), self.repeat),
+            "render": measure(lambda: hammock.writer.write(self.outdir), self.repeat, setup=self.clean_outdir),
+            "render_shards": measure(self.write_shards(hammock), self.repeat, setup=self.clean_outdir),
+            "startup": measure(lambda: self.python("-c", "import hammocking.hammocking"), self.repeat),
+            "startup_help": measure(lambda: self.python("-m", "hammocking", "--help"), self.repeat),
+            "end_to_end": measure(self.end_to_end, self.repeat, setup=self.clean_outdir),
+        }
+        # A run whose stamp matches, i.e. the startup of a build where nothing changed
+        self.clean_outdir()
+        stamp = self.project.root / "stamp.json"
+        self.end_to_end("--stamp", str(stamp))
+        stages["no_op"] = measure(lambda: self.end_to_end("--stamp", str(stamp)), self.repeat)
+        cache_dir = self.project.root / "cache"
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        self.end_to_end("--cache-dir", str(cache_dir))
+        stages["end_to_end_cached"] = measure(lambda: self.end_to_end("--cache-dir", str(cache_dir)), self.repeat,
+                                              setup=self.clean_outdir)
+        return stages
+
+    def write_shards(self, hammock: Hammock) -> Callable[[], None]:
+        writer = MockupWriter(shards=4)
+        writer.headers, writer.variables, writer.functions = hammock.writer.headers, hammock.writer.variables, hammock.writer.functions
+        return lambda: writer.write(self.outdir)
+
+
+def run_suite(sizes: Dict[str, ProjectSize], repeat: int = 3, workdir: Optional[Path] = None) -> dict:
+    """Generate and build a project of each size and time all stages on it"""
+    ConfigReader()
+    LibClang.load()
+    results = {"meta": metadata(), "sizes": {}}
+    with tempfile.TemporaryDirectory() as temporary:
+        for name, size in sizes.items():
+            root = Path(workdir or temporary, name)
+            shutil.rmtree(root, ignore_errors=True)
+            project = SyntheticProject(root, size).generate()
+            project.build()
+            print(f"{name}: {size.headers} headers, {len(project.symbols)} symbols to mock", file=sys.stderr)
+            results["sizes"][name] = {"project": project.describe(), "stages": Benchmark(project, repeat).run()}
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "libclang": LibClang.library, "libclang_version": LibClang.version, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(baseline: dict, results: dict, threshold: float = 0.1) -> List[str]:
+    """A line per stage with the change of the median time. Returns the regressions above the threshold."""
+    regressions = []
+    print(f"{'size':10} {'stage':20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for size, entry in results["sizes"].items():
+        for stage, timing in entry["stages"].items():
+            before = baseline["sizes"].get(size, {}).get("stages", {}).get(stage)
+            if before is None:
+                print(f"{size:10} {stage:20} {'-':>10} {timing['median']:10.4f}")
+                continue
+            change = timing["median"] / before["median"] - 1
+            line = f"{size:10} {stage:20} {before['median']:10.4f} {timing['median']:10.4f} {change:+8.1%}"
+            print(line)
+            if change > threshold:
+                regressions.append(line)
+    return regressions
+
+
+def load(path: Path) -> dict:
+    return json.loads(Path(path).read_text())
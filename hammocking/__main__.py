@@ -1,5 +1,9 @@
 import sys
-from .hammocking import main
 
 if __name__ == '__main__':
-   main(sys.argv[1:])
+   if sys.argv[1:2] == ["client"]:
+      from .client import main
+      main(sys.argv[2:])
+   else:
+      from .hammocking import main
+      main(sys.argv[1:])
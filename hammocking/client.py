@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Thin client for the hammocking server (``python -m hammocking serve``).
+
+It takes the same arguments as hammocking itself and forwards them to the server, so that the
+libclang and Jinja setup is not paid on every call. If no server is listening, the mockups are
+created in this process instead.
+"""
+
+import sys
+import os
+import json
+import socket
+import tempfile
+from pathlib import Path
+
+
+def default_socket_path() -> Path:
+    if "HAMMOCKING_SOCKET" in os.environ:
+        return Path(os.environ["HAMMOCKING_SOCKET"])
+    if "XDG_RUNTIME_DIR" in os.environ:
+        return Path(os.environ["XDG_RUNTIME_DIR"]) / "hammocking.sock"
+    return Path(tempfile.gettempdir()) / f"hammocking-{getattr(os, 'getuid', lambda: 0)()}" / "hammocking.sock"
+
+
+def request(socket_path: Path, message: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(socket_path))
+        connection.sendall(json.dumps(message).encode())
+        connection.shutdown(socket.SHUT_WR)
+        chunks = []
+        while chunk := connection.recv(65536):
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+def main(pargv):
+    socket_path = default_socket_path()
+    if pargv[:1] == ["--socket"]:
+        socket_path = Path(pargv[1])
+        pargv = pargv[2:]
+    try:
+        response = request(socket_path, {"cwd": os.getcwd(), "argv": pargv})
+    except (OSError, AttributeError):  # No server listening (or no Unix sockets at all)
+        from .hammocking import main as run_locally
+        run_locally(pargv)
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    exit(response["exit"])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
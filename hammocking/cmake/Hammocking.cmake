@@ -0,0 +1,83 @@
+# Create mockups with hammocking as part of a CMake build.
+#
+#   include(<hammocking package directory>/cmake/Hammocking.cmake)
+#
+#   hammocking_add_mockup(
+#       OUTDIR <directory>                   # where the mockup is created, default: the current binary directory
+#       SOURCES <source> ...                 # sources to read the declarations from
+#       PLINK <object> ... | SYMBOLS <symbol> ...
+#       [STYLE gmock|plain_c|fake_c] [SUFFIX <suffix>]
+#       [ARGS_FROM <target>]                 # take the include directories and definitions of this target
+#       [ARGS <argument> ...]                # further compiler arguments
+#       [OUTPUTS <variable>])                # set to the created files, to be added to the test executable
+#
+# hammocking writes a dependency file listing the sources, every header it read, the configuration and the
+# templates. With it, the mockup is only created again if one of them (or the object) changes. Dependency files
+# of custom commands need CMake 3.20 and the Ninja or Makefile generators. The variable given by OUTPUTS also
+# contains the marker file of the command, which custom targets have to depend on.
+
+include_guard(GLOBAL)
+if(CMAKE_VERSION VERSION_LESS 3.20)
+    message(FATAL_ERROR "Hammocking.cmake needs CMake 3.20 or newer for the dependency files of custom commands")
+endif()
+
+set(HAMMOCKING_DIR ${CMAKE_CURRENT_LIST_DIR}/.. CACHE PATH "Directory of the hammocking package")
+if(NOT HAMMOCKING_PYTHON)
+    find_package(Python3 REQUIRED COMPONENTS Interpreter)
+    set(HAMMOCKING_PYTHON ${Python3_EXECUTABLE} CACHE FILEPATH "Python interpreter to run hammocking with")
+endif()
+
+function(hammocking_add_mockup)
+    cmake_parse_arguments(PARSE_ARGV 0 HM "" "OUTDIR;STYLE;SUFFIX;ARGS_FROM;OUTPUTS" "SOURCES;PLINK;SYMBOLS;ARGS")
+    if(NOT HM_OUTDIR)
+        set(HM_OUTDIR ${CMAKE_CURRENT_BINARY_DIR})
+    endif()
+    if(NOT HM_STYLE)
+        set(HM_STYLE gmock)
+    endif()
+    if(HM_STYLE STREQUAL "gmock")
+        set(outputs ${HM_OUTDIR}/mockup${HM_SUFFIX}.h ${HM_OUTDIR}/mockup${HM_SUFFIX}.cc)
+    else()
+        set(outputs ${HM_OUTDIR}/mockup${HM_SUFFIX}.h ${HM_OUTDIR}/mockup${HM_SUFFIX}.c)
+    endif()
+    set(depfile ${HM_OUTDIR}/mockup${HM_SUFFIX}.d)
+    # Unchanged mockups are not written again, so that they are not compiled again. Only the marker tells the build
+    # that the mockup is up to date.
+    set(marker ${HM_OUTDIR}/mockup${HM_SUFFIX}.done)
+
+    set(symbols)
+    if(HM_PLINK)
+        set(symbols --plink ${HM_PLINK})
+    elseif(HM_SYMBOLS)
+        set(symbols --symbols ${HM_SYMBOLS})
+    else()
+        message(FATAL_ERROR "hammocking_add_mockup needs PLINK or SYMBOLS")
+    endif()
+    set(arguments --style ${HM_STYLE})
+    if(HM_SUFFIX)
+        list(APPEND arguments --suffix ${HM_SUFFIX})
+    endif()
+    if(HM_ARGS_FROM)
+        set(includes $<TARGET_PROPERTY:${HM_ARGS_FROM},INCLUDE_DIRECTORIES>)
+        set(definitions $<TARGET_PROPERTY:${HM_ARGS_FROM},COMPILE_DEFINITIONS>)
+        list(APPEND arguments "$<$<BOOL:${includes}>:-I$<JOIN:${includes},$<SEMICOLON>-I>>" "$<$<BOOL:${definitions}>:-D$<JOIN:${definitions},$<SEMICOLON>-D>>")
+    endif()
+
+    file(MAKE_DIRECTORY ${HM_OUTDIR})
+    add_custom_command(
+        OUTPUT ${marker}
+        BYPRODUCTS ${outputs}
+        COMMAND ${HAMMOCKING_PYTHON} ${HAMMOCKING_DIR}/hammocking.py ${symbols} --sources ${HM_SOURCES} --outdir ${HM_OUTDIR}
+                --depfile ${depfile} --depfile-target ${marker} ${arguments} ${HM_ARGS}
+        COMMAND ${CMAKE_COMMAND} -E touch ${marker}
+        DEPENDS ${HM_PLINK} ${HM_SOURCES}
+        DEPFILE ${depfile}
+        WORKING_DIRECTORY ${CMAKE_CURRENT_SOURCE_DIR}
+        COMMENT "Creating mockup in ${HM_OUTDIR}"
+        COMMAND_EXPAND_LISTS
+        VERBATIM
+    )
+    if(HM_OUTPUTS)
+        set(${HM_OUTPUTS} ${outputs} ${marker} PARENT_SCOPE)
+    endif()
+endfunction()
@@ -1,26 +1,107 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import sys
+import os
 from os import listdir, environ
 from os.path import dirname
-
-sys.path.append(dirname(__file__))
-
-from subprocess import Popen, PIPE
 import re
-from argparse import ArgumentParser
+import io
+import json
+from contextlib import redirect_stdout, redirect_stderr, contextmanager
+from argparse import ArgumentParser, Namespace
 from pathlib import Path
-from typing import List, Set, Union, Tuple, Iterator, Iterable, Optional
-from clang.cindex import Index, TranslationUnit, Cursor, CursorKind, Config, Type, TypeKind
-from jinja2 import Environment, FileSystemLoader
+from typing import List, Set, Union, Tuple, Iterator, Iterable, Optional, Dict, TYPE_CHECKING
+from itertools import chain
 import logging
 import configparser
+import hashlib
+import mmap
+import stat
+import struct
+import time
+import threading
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# clang.cindex, jinja2, ctypes, subprocess, tempfile and the executors are imported where they are needed,
+# so that a run with an up-to-date stamp does not pay for them. See LibClang for the names of clang.cindex.
+if TYPE_CHECKING:
+    import socket
+    from clang.cindex import Cursor, Index, TranslationUnit
+    from jinja2 import Environment
+
+
+class TypeInfo:
+    """
+    What is needed to declare and initialize a type, without a reference to its translation unit.
+    Templates use it like a RenderableType (e.g. function.type.render(name)), except for the libclang type.
+    """
+    __slots__ = ("spelling", "declarator", "storage", "is_array", "is_struct", "is_constant", "is_void", "_initializer")
+
+    def __init__(self, t: RenderableType) -> None:
+        self.spelling = t.spelling
+        self.declarator = t.declarator()
+        self.storage = t.storage_declarator()
+        self.is_array = t.is_array
+        self.is_struct = t.is_struct
+        self.is_constant = t.is_constant
+        self.is_void = t.t.kind == TypeKind.VOID
+        self._initializer = t.initializer()
+
+    def render(self, name: str) -> str:
+        return self.declarator[0] + name + self.declarator[1]
+
+    def initializer(self) -> str:
+        return self._initializer
+
+    def to_record(self) -> dict:
+        """Plain data representation, independent of libclang"""
+        return {
+            "spelling": self.spelling,
+            "declarator": list(self.declarator),
+            "storage": list(self.storage),
+            "array": self.is_array,
+            "struct": self.is_struct,
+            "constant": self.is_constant,
+            "void": self.is_void,
+            "initializer": self._initializer,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "TypeInfo":
+        info = cls.__new__(cls)
+        info.spelling = record["spelling"]
+        info.declarator = tuple(record["declarator"])
+        info.storage = tuple(record["storage"])
+        info.is_array = record["array"]
+        info.is_struct = record["struct"]
+        info.is_constant = record["constant"]
+        info.is_void = record["void"]
+        info._initializer = record["initializer"]
+        return info
 
 
 class RenderableType:
+    infos = {}  # (spelling, canonical spelling) -> TypeInfo, emptied at the start of a run
+
     def __init__(self, t):
+        LibClang.import_cindex()
         self.t = t
 
+    @classmethod
+    def info(cls, t) -> TypeInfo:
+        """The type info of a type, analyzed only for the first type of the same spelling and canonical type"""
+        LibClang.import_cindex()
+        key = (t.spelling, t.get_canonical().spelling)
+        info = cls.infos.get(key)
+        if info is None:
+            info = cls.infos[key] = TypeInfo(cls(t))
+        return info
+
     @staticmethod
     def _collect_arguments(params) -> str:
        # TODO: Merge with Function _collect_arguments
@@ -35,41 +116,78 @@ class RenderableType:
        return ", ".join(arguments)
 
     def render(self, name: str) -> str:
+        before, after = self.declarator()
+        return before + name + after
+
+    def declarator(self) -> Tuple[str, str]:
+        """The C code before and after the name, when a name of this type is declared"""
         if self.t.kind == TypeKind.CONSTANTARRAY:
-            res = f"{name}[{self.t.get_array_size()}]"
-            element_type = RenderableType(self.t.get_array_element_type())
-            return element_type.render(res)
+            before, after = RenderableType(self.t.get_array_element_type()).declarator()
+            return before, f"[{self.t.get_array_size()}]" + after
         elif self.t.kind == TypeKind.INCOMPLETEARRAY:
-            res = f"{name}[]"
-            element_type = RenderableType(self.t.get_array_element_type())
-            return element_type.render(res)
+            before, after = RenderableType(self.t.get_array_element_type()).declarator()
+            return before, "[]" + after
         elif self.t.kind == TypeKind.POINTER and self.t.get_pointee().kind == TypeKind.FUNCTIONPROTO:
             # param is of type function pointer
             pt = self.t.get_pointee()
-            args = [arg for arg in pt.argument_types()]
-            return f"{pt.get_result().spelling} (*{name})({','.join(arg.spelling for arg in pt.argument_types())})"
+            return f"{pt.get_result().spelling} (*", f")({','.join(arg.spelling for arg in pt.argument_types())})"
         else:
-            return self.t.spelling + " " + name
+            return self.t.spelling + " ", ""
+
+    def storage_declarator(self) -> Tuple[str, str]:
+        """
+        The C code before and after the name of an assignable variable holding a value of this type, as passed
+        to or returned from a function: arrays decay to pointers to their elements, top level const is dropped
+        """
+        if self.is_array:
+            element = self.array_type().get_array_element_type()
+            before, after = RenderableType(element).declarator()
+            if self.is_constant and not element.is_const_qualified():  # e.g. const arr_t
+                before = before + "const " if element.kind == TypeKind.POINTER else "const " + before
+            return (before + "(*", ")" + after) if after else (before + "*", "")
+        before, after = self.declarator()
+        if self.t.is_const_qualified():
+            if before.rstrip().endswith("const"):  # Constant pointer
+                before = re.sub(r"\bconst$", "", before.rstrip())
+            else:
+                before = re.sub(r"^const\s+", "", before)
+        return before, after
+
+    def array_type(self):
+        """The array type, also if it is hidden behind typedefs"""
+        t = self.t
+        while not self.is_array_kind(t.kind):
+            if t.kind == TypeKind.ELABORATED:
+                t = t.get_named_type()
+            elif t.kind == TypeKind.TYPEDEF:
+                t = t.get_declaration().underlying_typedef_type
+            else:
+                return self.t.get_canonical()
+        return t
 
     @property
     def is_constant(self) -> bool:
         if self.is_array:
-            return self.t.element_type.is_const_qualified()
+            canonical = self.t.get_canonical()
+            return canonical.is_const_qualified() or canonical.get_array_element_type().is_const_qualified()
         else:
             return self.t.is_const_qualified()
 
     @property
     def is_array(self) -> bool:
+        return self.is_array_kind(self.t.get_canonical().kind)
+
+    @staticmethod
+    def is_array_kind(kind) -> bool:
         # many array kinds will make problems, but they are array types.
-        return self.t.kind == TypeKind.CONSTANTARRAY \
-            or self.t.kind == TypeKind.INCOMPLETEARRAY \
-            or self.t.kind == TypeKind.VARIABLEARRAY \
-            or self.t.kind == TypeKind.DEPENDENTSIZEDARRAY
+        return kind == TypeKind.CONSTANTARRAY \
+            or kind == TypeKind.INCOMPLETEARRAY \
+            or kind == TypeKind.VARIABLEARRAY \
+            or kind == TypeKind.DEPENDENTSIZEDARRAY
     
     @property
     def is_struct(self) -> bool:
-        fields = list(self.t.get_canonical().get_fields())
-        return len(fields) > 0
+        return next(iter(self.t.get_canonical().get_fields()), None) is not None
     
     def initializer(self) -> str:
         if self.is_struct:
@@ -91,7 +209,10 @@ class ConfigReader:
     def __init__(self, configfile: Path = None):
         if configfile is None or configfile == Path(""):
             configfile = ConfigReader.configfile
+        self.configfile = configfile
         self.exclude_pathes = []
+        self.cache_dir = None
+        self.cache_size = None
         if not configfile.exists():
             return
         config = configparser.ConfigParser()
@@ -104,73 +225,227 @@ class ConfigReader:
     def _scan(self, items: Iterator[Tuple[str, str]]) -> None:
         for item, value in items:
             if item == "clang_lib_file":
-                Config.set_library_file(value)
+                LibClang.configure(library_file=value)
             if item == "clang_lib_path":
-                Config.set_library_path(value)
+                LibClang.configure(library_path=value)
             if item == "nm":
                 NmWrapper.set_nm_path(value)
+            if item == "nm_backend":
+                NmWrapper.set_backend(value)
             if item == "ignore_path":
                 self.exclude_pathes = value.split(",")
             if item == "include_pattern":
                 NmWrapper.set_include_pattern(value)
             if item == "exclude_pattern":
                 NmWrapper.set_exclude_pattern(value)
+            if item == "cache_dir":
+                self.cache_dir = Path(value).expanduser()
+            if item == "cache_size":
+                self.cache_size = int(value)
+
+
+class LibClang:
+    """
+    Imports clang.cindex on first use and loads libclang. The location of the library that was loaded and its
+    version are kept in a probe file, so that the next process loads the same library without searching for it.
+    """
+    names = ["Index", "TranslationUnit", "Cursor", "CursorKind", "Config", "Type", "TypeKind", "Diagnostic",
+             "CompilationDatabase", "conf"]
+    library_file = None
+    library_path = None
+    probe_file = Path(environ.get("XDG_CACHE_HOME") or Path.home() / ".cache", "hammocking", "libclang.json")
+    library = None  # Path of the loaded library and its version, once it is loaded
+    version = None
+
+    @classmethod
+    def configure(cls, library_file: Optional[str] = None, library_path: Optional[str] = None) -> None:
+        """Library file or directory as configured, applied unless libclang is already loaded"""
+        cls.library_file = library_file or cls.library_file
+        cls.library_path = library_path or cls.library_path
+        if "Config" in globals():
+            cls.apply()
+
+    @classmethod
+    def import_cindex(cls) -> None:
+        """Make the names of clang.cindex available in this module"""
+        if "Config" in globals():
+            return
+        import clang.cindex
+        globals().update((name, getattr(clang.cindex, name)) for name in cls.names)
+        cls.apply()
+
+    @classmethod
+    def apply(cls) -> None:
+        if Config.loaded:
+            return
+        if cls.library_file:
+            Config.set_library_file(cls.library_file)
+        if cls.library_path:
+            Config.set_library_path(cls.library_path)
+
+    @classmethod
+    def load(cls) -> None:
+        """Load libclang, preferably the one found by an earlier process with the same configuration"""
+        cls.import_cindex()
+        if Config.loaded:
+            return
+        with Profile.phase("load libclang"):
+            probe = cls.read_probe()
+            if probe is not None:
+                Config.set_library_file(probe["library"])
+                cls.library, cls.version = probe["library"], probe["version"]
+            library = conf.lib
+            if probe is None:
+                cls.library, cls.version = cls.location(library), cls.read_version(library)
+                cls.write_probe()
+
+    @classmethod
+    def settings(cls) -> List[Optional[str]]:
+        """The configuration and the bindings (of this environment) the library is probed for"""
+        return [cls.library_file, cls.library_path, getattr(sys.modules.get("clang.cindex"), "__file__", None)]
+
+    @classmethod
+    def read_probe(cls) -> Optional[dict]:
+        """The probed library, if it was probed with the same settings and did not change since"""
+        try:
+            probe = json.loads(cls.probe_file.read_text())
+            if probe["settings"] == cls.settings() and os.stat(probe["library"]).st_mtime_ns == probe["mtime"]:
+                return probe
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    @classmethod
+    def write_probe(cls) -> None:
+        if cls.library is None:
+            return
+        try:
+            probe = {"settings": cls.settings(), "library": cls.library, "mtime": os.stat(cls.library).st_mtime_ns,
+                     "version": cls.version}
+            cls.probe_file.parent.mkdir(parents=True, exist_ok=True)
+            temp = cls.probe_file.with_name(f"{cls.probe_file.name}.{os.getpid()}.tmp")
+            temp.write_text(json.dumps(probe))
+            os.replace(temp, cls.probe_file)
+        except OSError as e:
+            logging.debug(f"libclang probe not written: {e}")
+
+    @staticmethod
+    def read_version(library) -> str:
+        from clang.cindex import _CXString
+        get_version = library.clang_getClangVersion
+        get_version.restype, get_version.errcheck = _CXString, _CXString.from_result
+        return get_version()
+
+    @staticmethod
+    def location(library) -> Optional[str]:
+        """Absolute path of a loaded library"""
+        import ctypes
+        if sys.platform == "win32":
+            buffer = ctypes.create_unicode_buffer(32768)
+            length = ctypes.windll.kernel32.GetModuleFileNameW(ctypes.c_void_p(library._handle), buffer, len(buffer))
+            return buffer.value if length else None
+
+        class DlInfo(ctypes.Structure):
+            _fields_ = [("dli_fname", ctypes.c_char_p), ("dli_fbase", ctypes.c_void_p),
+                        ("dli_sname", ctypes.c_char_p), ("dli_saddr", ctypes.c_void_p)]
+
+        info = DlInfo()
+        try:
+            dladdr = ctypes.CDLL(None).dladdr
+        except (OSError, AttributeError):
+            return None
+        dladdr.argtypes = [ctypes.c_void_p, ctypes.POINTER(DlInfo)]
+        if not dladdr(ctypes.cast(library.clang_getClangVersion, ctypes.c_void_p), ctypes.byref(info)) or not info.dli_fname:
+            return None
+        return os.path.abspath(os.fsdecode(info.dli_fname))
 
 
 class Variable:
+    __slots__ = ("name", "type", "_declarator", "_storage", "_is_constant", "_initializer")
+
     def __init__(self, c: Cursor) -> None:
-        self._type = RenderableType(c.type)
+        t = RenderableType.info(c.type)
         self.name = c.spelling
-
-    @property
-    def type(self) -> str:
-        """The variable type as string"""
-        return self._type.spelling
+        self.type = t.spelling
+        self._declarator = t.declarator
+        self._storage = t.storage
+        self._is_constant = t.is_constant
+        self._initializer = t.initializer()
 
     def get_definition(self, with_type: bool = True) -> str:
         if with_type:
-            return self._type.render(self.name)
+            return self._declarator[0] + self.name + self._declarator[1]
         else:
             return self.name
         
     def is_constant(self) -> bool:
         """Is constant qualified"""
-        return self._type.is_constant
+        return self._is_constant
+
+    def get_storage_definition(self) -> str:
+        """Definition of an assignable variable that can hold the value of this parameter: arrays decay to pointers"""
+        return self._storage[0] + self.name + self._storage[1]
     
     def initializer(self) -> str:
         """C expression to represent the value "0" according to the variable type"""        
-        return self._type.initializer()
+        return self._initializer
+
+    def to_record(self) -> dict:
+        """Plain data representation, independent of libclang"""
+        return {
+            "name": self.name,
+            "type": self.type,
+            "declarator": list(self._declarator),
+            "storage": list(self._storage),
+            "constant": self._is_constant,
+            "initializer": self._initializer,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Variable":
+        variable = cls.__new__(cls)
+        variable.name = record["name"]
+        variable.type = record["type"]
+        variable._declarator = tuple(record["declarator"])
+        variable._storage = tuple(record["storage"])
+        variable._is_constant = record["constant"]
+        variable._initializer = record["initializer"]
+        return variable
 
     def __repr__(self) -> str:
         return f"<{self.get_definition()}>"
 
 class Function:
+    __slots__ = ("name", "type", "params", "is_variadic", "_signature", "_call", "_param_types")
+
     def __init__(self, c: Cursor) -> None:
-        self.type = RenderableType(c.result_type)
+        self.type = RenderableType.info(c.result_type)
         self.name = c.spelling
         self.params = [Variable(arg) for arg in c.get_arguments()]
         self.is_variadic = c.type.is_function_variadic() if c.type.kind == TypeKind.FUNCTIONPROTO else False
+        self._prepare()
 
-    def get_signature(self) -> str:
-        """
-        Return the function declaration form
-        """
-        return f"{self.type.render(self.name)}({self._collect_arguments(True)}{', ...' if self.is_variadic else ''})"
-
-    def _collect_arguments(self, with_types: bool) -> str:
+    def _prepare(self) -> None:
+        """Name the unnamed parameters and render the strings the templates ask for once"""
         unnamed_index = 1
-        arguments = []
         for param in self.params:
             if not param.name:
                 param.name = 'unnamed' + str(unnamed_index)
                 unnamed_index = unnamed_index + 1
-            arguments.append(param.get_definition(with_types))
+        arguments = ", ".join(param.get_definition() for param in self.params)
+        self._signature = f"{self.type.render(self.name)}({arguments}{', ...' if self.is_variadic else ''})"
+        self._call = f"{self.name}({', '.join(param.name for param in self.params)})"
+        self._param_types = ", ".join(param.type for param in self.params)
 
-        return ", ".join(arguments)
+    def get_signature(self) -> str:
+        """
+        Return the function declaration form
+        """
+        return self._signature
 
     def has_return_value(self) -> bool:
         """Does the function have a return value?"""
-        return self.type.t.kind != TypeKind.VOID
+        return not self.type.is_void
 
     @property
     def return_type(self) -> str:
@@ -181,6 +456,10 @@ class Function:
         """C expression to represent the value "0" according to the function return type"""
         return self.type.initializer()
 
+    def get_return_definition(self, name: str) -> str:
+        """Definition of an assignable variable (or array, e.g. "values[8]") of the return type"""
+        return self.type.storage[0] + name + self.type.storage[1]
+
     def get_call(self) -> str:
         """
         Return a piece of C code to call the function
@@ -188,106 +467,1093 @@ class Function:
         if self.is_variadic and False:  # TODO
             return "TODO"
         else:
-            return f"{self.name}({self._collect_arguments(False)})"
+            return self._call
 
     def get_param_types(self) -> str:
         """Return the function type parameters as a list of types"""
-        param_types = ", ".join(f"{param.type}" for param in self.params)
-        return f"{param_types}"
+        return self._param_types
+
+    def to_record(self) -> dict:
+        """Plain data representation, independent of libclang"""
+        return {
+            "name": self.name,
+            "type": self.type.to_record(),
+            "params": [param.to_record() for param in self.params],
+            "variadic": self.is_variadic,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Function":
+        function = cls.__new__(cls)
+        function.name = record["name"]
+        function.type = TypeInfo.from_record(record["type"])
+        function.params = [Variable.from_record(param) for param in record["params"]]
+        function.is_variadic = record["variadic"]
+        function._prepare()
+        return function
 
     def __repr__(self) -> str:
-        return f"<{self.type} {self.name} ({self.get_param_types()})>"
+        return f"<{self.return_type} {self.name} ({self.get_param_types()})>"
+
+
+class Declarations:
+    """
+    The top level declarations of one source, in their plain data representation.
+    Only the first declaration of a name is kept, as that is the one that gets mocked.
+    """
+    __slots__ = ("symbols", "includes")
+
+    def __init__(self, symbols: Dict[str, dict] = None, includes: List[str] = None) -> None:
+        self.symbols = symbols if symbols is not None else {}
+        self.includes = includes if includes is not None else []
+
+    def add(self, name: str, kind: str, file: str, header: Optional[str], record: Optional[dict] = None) -> None:
+        if name not in self.symbols:
+            self.symbols[name] = {"kind": kind, "file": file, "header": header, "record": record}
+
+    def to_json(self) -> dict:
+        return {"symbols": self.symbols, "includes": self.includes}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Declarations":
+        return cls(data["symbols"], data["includes"])
+
+
+class Profile:
+    """
+    Wall time, CPU time and growth of the peak memory of the phases of a run, written as Chrome trace events
+    (to be opened with chrome://tracing or https://ui.perfetto.dev). Parallel workers record their phases
+    with the start of the run's profile and hand them over with their results.
+    """
+    active = None  # The profile of the current run, if profiling
+
+    def __init__(self, path: Optional[Path], start: Optional[float] = None, name: str = "hammocking") -> None:
+        self.path = Path(path) if path else None
+        self.start = time.perf_counter() if start is None else start
+        self.events = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": name}}]
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name: str, **args) -> Iterator[dict]:
+        """Record the enclosed phase. The phase can add counters to the yielded arguments."""
+        profile = cls.active
+        if profile is None:
+            yield args
+            return
+        wall, cpu, max_rss = time.perf_counter(), time.process_time(), cls.max_rss_kb()
+        try:
+            yield args
+        finally:
+            args.update(cpu_ms=round((time.process_time() - cpu) * 1000, 3),
+                        max_rss_growth_kb=cls.max_rss_kb() - max_rss if max_rss is not None else None)
+            profile.events.append({"name": name, "cat": "hammocking", "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                   "ts": round((wall - profile.start) * 1e6), "dur": round((time.perf_counter() - wall) * 1e6),
+                                   "args": args})
+
+    @staticmethod
+    def max_rss_kb() -> Optional[int]:
+        if resource is None:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss // 1024 if sys.platform == 'darwin' else max_rss  # Bytes on Mac
+
+    def take_events(self) -> List[dict]:
+        """The events recorded since the last call"""
+        events, self.events = self.events, []
+        return events
+
+    def save(self) -> None:
+        self.path.write_text(json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms"}))
+
+
+class Cache:
+    """
+    Directory of JSON entries, addressed by a hash of everything the entry depends on.
+    Entries are replaced atomically, so that parallel runs can share the cache. If the cache grows
+    beyond its maximum size, the least recently used entries are evicted.
+    """
+    default_size = 256 * 1024 * 1024
+    code_hash = None  # Hash of hammocking itself, computed once
+
+    def __init__(self, directory: Path, max_size: int = None) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size or Cache.default_size
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.written = False
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(path: Union[Path, str]) -> Optional[str]:
+        try:
+            return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        except OSError:
+            return None
+
+    @classmethod
+    def versions(cls) -> List[Optional[str]]:
+        """The hammocking and libclang versions entries of extracted data depend on"""
+        LibClang.load()
+        if cls.code_hash is None:
+            cls.code_hash = cls.file_hash(__file__)
+        return [cls.code_hash, LibClang.version]
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / (key + ".json")
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            value = json.loads(path.read_text())
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        return value
+
+    umask = None
+
+    @classmethod
+    def file_mode(cls, path: Path) -> int:
+        """
+        The permissions of the file to be replaced, or the ones of a new file. Temporary files are only
+        readable by their owner, which would be kept by replacing the file.
+        """
+        try:
+            return stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            if cls.umask is None:
+                cls.umask = os.umask(0)
+                os.umask(cls.umask)
+            return 0o666 & ~cls.umask
+
+    def put(self, key: str, value) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        import tempfile
+        handle, temp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as file:
+                json.dump(value, file)
+            os.chmod(temp, self.file_mode(path))
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        self.written = True
+
+    def evict(self) -> None:
+        """Delete the least recently used entries, until the cache takes less than its maximum size"""
+        entries = []
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Evicted by a parallel run
+            entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            size -= entry_size
+        self.logger.debug(f"Cache size: {size} bytes")
+
+
+class Prelude:
+    """
+    Precompiled header of the includes the sources start with, so that they are parsed only once.
+    The precompiled header reports absolute paths for its declarations, these are mapped back to the
+    paths a parse of the source itself reports.
+    """
+    filename = "~hammocking_prelude.h"
+    include_pattern = re.compile(r'#\s*include\s*[<"][^>"]*[>"]')
+
+    def __init__(self, path: Path, sources: List[Path], content: Optional[str] = None) -> None:
+        self.path = path
+        self.sources = sources
+        self.content = content  # For a detected prelude, which only exists in memory
+        self.pch = None
+        self.names = {}
+        self.includes = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @classmethod
+    def leading_includes(cls, source: Path) -> List[str]:
+        """The include directives at the start of the source"""
+        text = re.sub(r"/\*.*?\*/", "", source.read_text(errors="replace"), flags=re.S)
+        includes = []
+        for line in text.splitlines():
+            line = re.sub(r"//.*", "", line).strip()
+            if not line:
+                continue
+            if not cls.include_pattern.fullmatch(line):
+                break
+            includes.append(line)
+        return includes
+
+    @classmethod
+    def detect(cls, sources: List[Path]) -> List["Prelude"]:
+        """Find the includes that all sources of a directory start with"""
+        directories = {}
+        for source in sources:
+            directories.setdefault(source.parent, []).append(source)
+        preludes = []
+        for directory, group in directories.items():
+            common = os.path.commonprefix([cls.leading_includes(source) for source in group])
+            if common:
+                preludes.append(cls(directory / cls.filename, group, "\n".join(common) + "\n"))
+        return preludes
+
+    def build(self, index: Index, args: List[str], cache: Optional[Cache], directory: Path) -> bool:
+        """
+        Create the precompiled header, or reuse the one in the cache if the prelude, the arguments
+        and all included files are unchanged.
+        """
+        content = self.content if self.content is not None else self.path.read_text(errors="replace")
+        key = Cache.key("prelude", Cache.versions(), self.path.absolute().as_posix(), content, args, os.getcwd())
+        if cache is not None:
+            directory = cache.directory / "pch"
+            manifest = cache.get(key)
+            if manifest is not None:
+                fingerprint = self.fingerprint(key, manifest["includes"])
+                pch = directory / (fingerprint + ".pch")
+                if pch.exists() and manifest["fingerprint"] == fingerprint:
+                    self.logger.debug(f"Using precompiled prelude {pch}")
+                    self.pch, self.names, self.includes = pch, manifest["names"], manifest["includes"]
+                    return True
+        parseOpts = {
+            "path": self.path,
+            "args": [arg + "-header" if arg in ("-xc", "-xc++") else arg for arg in args],
+            "options": TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | TranslationUnit.PARSE_INCOMPLETE,
+        }
+        if self.content is not None:
+            parseOpts["unsaved_files"] = [(self.path, self.content)]
+        translation_unit = index.parse(**parseOpts)
+        if any(diagnostic.severity >= Diagnostic.Error for diagnostic in translation_unit.diagnostics):
+            self.logger.debug(f"Prelude {self.path} not precompiled: {list(translation_unit.diagnostics)}")
+            return False
+        names = [include.include.name for include in translation_unit.get_includes()]
+        self.names = {os.path.abspath(name): name for name in names}
+        self.includes = list(dict.fromkeys(names))
+        if self.content is None:
+            self.includes.insert(0, str(self.path))
+        fingerprint = self.fingerprint(key, self.includes)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.pch = directory / (fingerprint + ".pch")
+        temp = self.pch.with_suffix(f".{os.getpid()}.tmp")
+        translation_unit.save(str(temp))
+        os.replace(temp, self.pch)
+        if cache is not None:
+            cache.put(key, {"includes": self.includes, "fingerprint": fingerprint, "names": self.names})
+        self.logger.debug(f"Precompiled prelude {self.path} to {self.pch}")
+        return True
+
+    @staticmethod
+    def fingerprint(key: str, includes: List[str]) -> str:
+        return Cache.key("pch", key, [(include, Cache.file_hash(include)) for include in includes])
+
+
+class Combined:
+    """
+    One translation unit with the include directives of all sources of a directory, deduplicated and in order,
+    so that the headers the sources have in common are parsed only once. It only exists in memory.
+    Sources whose includes are preceded by anything else, like a #define changing the declarations
+    of the included headers or an #if, are not combined but parsed on their own.
+    """
+    filename = "~hammocking_combined"
+
+    def __init__(self, path: Path, sources: List[Path], content: str) -> None:
+        self.path = path
+        self.sources = sources
+        self.content = content
+
+    @staticmethod
+    def includes(source: Path) -> Optional[List[str]]:
+        """The include directives the source starts with, None if any other line comes before one of its includes"""
+        text = re.sub(r"/\*.*?\*/", "", source.read_text(errors="replace"), flags=re.S)
+        includes = []
+        leading = True
+        for line in text.splitlines():
+            line = re.sub(r"//.*", "", line).strip()
+            if not line:
+                continue
+            if leading and Prelude.include_pattern.fullmatch(line):
+                includes.append(line)
+                continue
+            leading = False
+            if re.match(r"#\s*(include|import)", line):
+                return None
+        return includes
+
+    @classmethod
+    def detect(cls, sources: List[Path]) -> List["Combined"]:
+        """
+        A combined translation unit for each run of several consecutive sources of a directory that can be combined,
+        so that no source declares a symbol before the sources preceding it
+        """
+        groups = [[]]  # Runs of sources with their includes
+        for source in sources:
+            includes = cls.includes(source)
+            if includes is None:
+                logging.getLogger(cls.__name__).debug(f"{source} is not combined, its includes are not at its start")
+            if includes is None or (groups[-1] and groups[-1][0][0].parent != source.parent):
+                groups.append([])
+            if includes is not None:
+                groups[-1].append((source, includes))
+        combined = []
+        for group in groups:
+            if len(group) > 1:
+                unique = dict.fromkeys(include for _, includes in group for include in includes)
+                first = group[0][0]
+                combined.append(cls(first.parent / (cls.filename + first.suffix), [source for source, _ in group], "\n".join(unique) + "\n"))
+        return combined
+
+
+class SymbolIndex:
+    """
+    Persistent map of the symbols declared in a project's public headers to their declarations.
+    When the index is updated, only headers are parsed again whose content or included files changed.
+    """
+    version = 3
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.args = []
+        self.headers = {}  # header -> {"includes": [[file, hash], ...], "declarations": {...}}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") == SymbolIndex.version:
+            self.args = data["args"]
+            self.headers = data["headers"]
+
+    @staticmethod
+    def normalized(args: List[str]) -> List[str]:
+        """The parsing relevant arguments with absolute include paths, to compare arguments given in other directories"""
+        return CompileDb.filter(args, Path.cwd())
+
+    def matches(self, args: List[str]) -> bool:
+        """Were the headers indexed with the given arguments (including the language mode)?"""
+        return self.args == self.normalized(args)
+
+    def update(self, headers: List[Path], hammock: "Hammock") -> None:
+        """Parse the new and changed headers and drop the ones no longer given"""
+        args = self.normalized(hammock.parse_options(headers[0])["args"]) if headers else []
+        if args != self.args:
+            self.args, self.headers = args, {}
+        indexed = {}
+        for header in headers:
+            key = Path(os.path.abspath(header)).as_posix()
+            entry = self.headers.get(key)
+            if entry is None or any(Cache.file_hash(file) != hash for file, hash in entry["includes"]):
+                self.logger.info(f"Indexing {header}")
+                declarations = hammock.extract(header)
+                for declaration in declarations.symbols.values():
+                    # Absolute, as the mockups are created in other directories
+                    declaration["file"] = Path(os.path.abspath(declaration["file"])).as_posix()
+                    declaration["header"] = Path(os.path.abspath(declaration["header"] or header)).as_posix()
+                entry = {"includes": [[os.path.abspath(file), Cache.file_hash(file)] for file in declarations.includes],
+                         "declarations": declarations.to_json()}
+            indexed[key] = entry
+        self.headers = indexed
+
+    def save(self) -> None:
+        temp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        temp.write_text(json.dumps({"version": SymbolIndex.version, "args": self.args, "headers": self.headers}))
+        os.replace(temp, self.path)
+
+    def declarations(self) -> Declarations:
+        """All indexed declarations, the first header declaring a symbol wins"""
+        declarations = Declarations()
+        for entry in self.headers.values():
+            declarations.includes.extend(file for file, _ in entry["includes"])
+            for name, declaration in entry["declarations"]["symbols"].items():
+                declarations.add(name, declaration["kind"], declaration["file"], declaration["header"], declaration["record"])
+        return declarations
+
+
+class CompileDb:
+    """
+    The compiler arguments of the sources in a compilation database (compile_commands.json), without
+    the ones that do not change how a source is parsed, so that equal parses and cache entries are shared.
+    """
+    ignored = re.compile(r"-O.*|-W(?!p,).*|-g.*|-M[DM]?|-MM?D|-MP|-c|-pipe|-v|-fdiagnostics-.*|-fcolor-diagnostics")
+    ignored_with_value = {"-o", "-MF", "-MT", "-MQ"}
+    path_options = ("-include-pch", "-include", "-imacros", "-isystem", "-iquote", "-idirafter", "-I")  # Longest prefix first
+
+    def __init__(self, path: Path) -> None:
+        LibClang.load()
+        self.path = self.location(path)
+        if self.path.name != "compile_commands.json":  # libclang only loads it by its directory
+            raise ValueError(f"{self.path}: the compilation database must be named compile_commands.json")
+        self.database = CompilationDatabase.fromDirectory(str(self.path.parent))
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def location(path: Path) -> Path:
+        """The compile_commands.json given by itself or by its directory"""
+        path = Path(path)
+        return path / "compile_commands.json" if path.is_dir() else path
+
+    def arguments(self, source: Path) -> Optional[List[str]]:
+        """The parsing relevant arguments of the source, None if it is not in the database"""
+        commands = self.database.getCompileCommands(str(source.absolute()))
+        if not commands:
+            return None
+        command = commands[0]
+        return self.filter(list(command.arguments)[1:], Path(command.directory), Path(command.directory, command.filename))
+
+    @classmethod
+    def filter(cls, arguments: List[str], directory: Path, filename: Optional[Path] = None) -> List[str]:
+        """Drop the compiler's output, warning, optimization and debug flags and make the include paths absolute"""
+        filtered = []
+        arguments = iter(arguments)
+        for argument in arguments:
+            if argument == "--":  # Only input files follow
+                break
+            if argument in cls.ignored_with_value:
+                next(arguments, None)
+            elif cls.ignored.fullmatch(argument) or Path(directory, argument) == filename:
+                continue
+            elif argument.startswith(cls.path_options):
+                option = next(option for option in cls.path_options if argument.startswith(option))
+                path = str(Path(directory, argument[len(option):] or next(arguments, "")))
+                filtered += [option + path] if option == "-I" else [option, path]
+            else:
+                filtered.append(argument)
+        return filtered
+
+    def group(self, sources: List[Path]) -> Dict[Tuple[str, ...], List[Path]]:
+        """The sources grouped by their arguments, in the order of their first source"""
+        groups = {}
+        for source in sources:
+            arguments = self.arguments(source)
+            if arguments is None:
+                self.logger.warning(f"{source} not found in {self.path}, parsing it without its compiler arguments")
+                arguments = []
+            groups.setdefault(tuple(arguments), []).append(source)
+        return groups
+
+
+class Stamp:
+    """
+    Fingerprint of all inputs of a mockup: the arguments, the sources, the symbols (or the object
+    providing them), the configuration, the templates and hammocking itself. Together with the
+    hashes of all files the declarations were read from, it tells whether the mockup is up to date.
+    """
+
+    def __init__(self, path: Path, inputs: str) -> None:
+        self.path = Path(path)
+        self.inputs = inputs
+        self.files = []  # The files the declarations were read from last time, if up to date
+        self.outputs = []  # The files the mockup was written to, if up to date
+
+    @staticmethod
+    def fingerprint(args: Namespace, cmd_args: List[str], config: ConfigReader, writers: List["MockupWriter"]) -> str:
+        return Cache.key(
+            Cache.file_hash(__file__),
+            [(template, Cache.file_hash(writer.style_dir / template)) for writer in writers for template in writer.templates()],
+            Cache.file_hash(config.configfile),
+            sorted(args.symbols) if args.symbols else [(str(plink), Cache.file_hash(plink)) for plink in args.plink],
+            sorted(args.exclude),
+            args.exclude_pathes,
+            [(str(source), Cache.file_hash(source)) for source in args.sources],
+            cmd_args,
+            args.style,
+            args.suffix,
+            args.shards,
+            args.fake_history,
+            str(args.outdir),
+            [str(args.index), Cache.file_hash(args.index)] if args.index else None,
+            [str(args.compile_db), Cache.file_hash(CompileDb.location(args.compile_db))] if args.compile_db else None,
+            str(args.prelude),
+            args.combine,
+        )
+
+    def check(self) -> Optional[List[str]]:
+        """
+        The symbols that could not be mocked last time, if the mockup is up to date, otherwise None.
+        The written files are recorded, as the parts of a mockup sharded by header depend on the declarations.
+        """
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data["inputs"] != self.inputs or not all(Path(output).exists() for output in data.get("outputs", [""])):
+            return None
+        if any(Cache.file_hash(file) != hash for file, hash in data["files"]):
+            return None
+        self.files = [file for file, _ in data["files"]]
+        self.outputs = [Path(output) for output in data["outputs"]]
+        return data["unresolved"]
+
+    def write(self, files: Iterable[str], unresolved: Iterable[str], outputs: Iterable[Path]) -> None:
+        data = {"inputs": self.inputs, "files": [[file, Cache.file_hash(file)] for file in files],
+                "outputs": [str(output) for output in outputs], "unresolved": sorted(unresolved)}
+        MockupWriter.write_if_different(self.path, json.dumps(data, indent=1))
+
+
+class History:
+    """
+    The symbols each source declared in the last runs, to parse the sources declaring the most symbols first.
+    An entry is only trusted to tell that a source does not declare a symbol while the source, all files it
+    included and its arguments are unchanged.
+    """
+    version = 1
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.sources = {}
+        self.hashes = {}
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("version") == History.version:
+                self.sources = data["sources"]
+        except (OSError, ValueError):
+            pass
+
+    def fingerprint(self, files: Iterable[str], args: List[str]) -> str:
+        for file in files:
+            if file not in self.hashes:
+                self.hashes[file] = Cache.file_hash(file)
+        return Cache.key(args, [(file, self.hashes[file]) for file in files])
+
+    def entry(self, source: Path, args: List[str]) -> Tuple[Optional[dict], bool]:
+        """The entry of the source and whether it can be trusted"""
+        entry = self.sources.get(source.absolute().as_posix())
+        if entry is None:
+            return None, False
+        return entry, entry["fingerprint"] == self.fingerprint(entry["files"], args)
+
+    def record(self, source: Path, args: List[str], declarations: Declarations, checked: Set[str]) -> None:
+        files = [os.path.abspath(file) for file in declarations.includes]
+        self.sources[source.absolute().as_posix()] = {
+            "fingerprint": self.fingerprint(files, args),
+            "files": files,
+            "checked": sorted(checked),
+            "declared": sorted(checked.intersection(declarations.symbols)),
+        }
+
+    def save(self) -> None:
+        MockupWriter.write_if_different(self.path, json.dumps({"version": History.version, "sources": self.sources}))
+
+
+class Depfile:
+    """
+    Dependencies of the mockup in the Makefile syntax understood by Make, Ninja and CMake's DEPFILE,
+    so that the build runs hammocking again only if one of them changes
+    """
+
+    def __init__(self, path: Path, target: Optional[Path] = None) -> None:
+        self.path = Path(path)
+        self.target = target
+
+    @staticmethod
+    def escape(path: Union[Path, str]) -> str:
+        return os.path.abspath(path).replace("\\", "/").replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+    def write(self, outputs: Iterable[Path], dependencies: Iterable[Union[Path, str]]) -> bool:
+        rule = " ".join(map(self.escape, [self.target] if self.target else outputs)) + ":"
+        dependencies = (dependency for dependency in dependencies if os.path.exists(dependency))
+        rule += "".join(f" \\\n  {dependency}" for dependency in dict.fromkeys(map(self.escape, dependencies)))
+        return MockupWriter.write_if_different(self.path, rule + "\n")
 
 
 class MockupWriter:
+    environments = {}  # Shared by all writers of a process, by template directory
+    chunk_size = 1 << 16
+    bytecode_cache_dir = None
+    rendered = None  # Set to a dict (output -> fingerprint) to skip rendering outputs whose variables did not change (watch mode)
 
-    def __init__(self, mockup_style="gmock", suffix=None) -> None:
+    def __init__(self, mockup_style="gmock", suffix=None, shards: Union[int, str, None] = None, fake_history: int = 8) -> None:
         self.headers = []
         self.variables = []
         self.functions = []
+        self.origins = {}  # Function name -> header it is declared in, to shard by header
+        self._context = None
+        self._parts = []
+        self.shared = None  # The writer whose declarations are rendered, if not the own ones
         self.template_dir = f"{dirname(__file__)}/templates"
-        self.mockup_style = mockup_style
+        self.set_mockup_style(mockup_style)
         self.suffix = suffix or ""
+        if isinstance(shards, int) and shards < 1:
+            raise ValueError(f"The number of shards must be at least 1, not {shards}")
+        self.shards = shards
+        self.fake_history = fake_history  # Calls recorded per function by the fake_c style
         self.logger = logging.getLogger("HammocKing")
-        self.environment = Environment(
-            loader=FileSystemLoader(f"{self.template_dir}/{self.mockup_style}"),
-            keep_trailing_newline=True,
-            trim_blocks=True
-        )
 
     def set_mockup_style(self, mockup_style: str) -> None:
+        """Set a built-in style or the path of a directory with custom templates"""
         self.mockup_style = mockup_style
+        self.style_dir = Path(self.template_dir, mockup_style)
+        if not self.style_dir.is_dir() and Path(mockup_style).is_dir():
+            self.style_dir = Path(mockup_style).absolute()
+
+    @staticmethod
+    def parse_style(entry: str, suffix: Optional[str], outdir: Optional[Path]) -> Tuple[str, Optional[str], Optional[Path]]:
+        """Split a "style[:suffix[:outdir]]" entry, the suffix and the output directory default to the given ones"""
+        if Path(entry).is_dir():  # A directory with custom templates
+            return entry, suffix, outdir
+        style, _, rest = entry.partition(":")
+        entry_suffix, colon, entry_outdir = rest.partition(":")
+        return style, entry_suffix or suffix, Path(entry_outdir) if colon and entry_outdir else outdir
+
+    def share(self, writer: "MockupWriter") -> None:
+        """Render the declarations of another writer, which are sorted only once for all writers"""
+        self.headers, self.variables, self.functions, self.origins = writer.headers, writer.variables, writer.functions, writer.origins
+        self.shared = writer
+        self._context = None
+
+    @classmethod
+    def set_bytecode_cache_dir(cls, path: Optional[Path]) -> None:
+        """Keep the compiled templates in this directory, so that they are not compiled again by the next process"""
+        cls.bytecode_cache_dir = path
+
+    @property
+    def environment(self) -> Environment:
+        key = (self.style_dir, self.bytecode_cache_dir)
+        if key not in self.environments:
+            from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+            bytecode_cache = None
+            if self.bytecode_cache_dir is not None:
+                Path(self.bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(str(self.bytecode_cache_dir))
+            self.environments[key] = Environment(
+                loader=FileSystemLoader(self.style_dir),
+                bytecode_cache=bytecode_cache,
+                keep_trailing_newline=True,
+                trim_blocks=True
+            )
+        return self.environments[key]
 
     def add_header(self, name: str) -> None:
         """Add a header to be included in mockup"""
         if name not in self.headers:
             self.headers.append(name)
+            self._context = None
 
-    def add_variable(self, c: Cursor) -> None:
-        """Add a variable definition"""
-        self.logger.info(f"Create mockup for variable {c.spelling}")
-        self.variables.append(Variable(c))
-
-    def add_function(self, c: Cursor) -> None:
+    def add_variable(self, c: Union[Cursor, Variable]) -> None:
         """Add a variable definition"""
-        self.logger.info(f"Create mockup for function {c.spelling}")
-        self.functions.append(Function(c))
+        variable = c if isinstance(c, Variable) else Variable(c)
+        self.logger.info(f"Create mockup for variable {variable.name}")
+        self.variables.append(variable)
+        self._context = None
+
+    def add_function(self, c: Union[Cursor, Function], header: Optional[str] = None) -> None:
+        """Add a function definition"""
+        function = c if isinstance(c, Function) else Function(c)
+        self.logger.info(f"Create mockup for function {function.name}")
+        self.functions.append(function)
+        self.origins[function.name] = header
+        self._context = None
 
     def get_mockup(self, file: str) -> str:
         return self.render(Path(file + '.j2'))
 
-    def render(self, file: Path) -> str:
-        return self.environment.get_template(f"{file}").render(
-            headers=sorted(self.headers),
-            variables=sorted(self.variables, key=lambda x: x.name),
-            functions=sorted(self.functions, key=lambda x: x.name),
-            suffix=self.suffix
-        )
+    def context(self) -> Dict[str, object]:
+        """The template variables, sorted once for all templates"""
+        if self._context is None:
+            if self.shared is not None:
+                shared = self.shared.context()
+                headers, variables, functions = shared["headers"], shared["variables"], shared["functions"]
+            else:
+                headers = sorted(self.headers)
+                variables = sorted(self.variables, key=lambda x: x.name)
+                functions = sorted(self.functions, key=lambda x: x.name)
+            self._parts = self.split(functions) if self.part_templates() else []
+            self._context = dict(
+                headers=headers,
+                variables=variables,
+                functions=functions,
+                parts=list(range(len(self._parts))),
+            )
+        return dict(self._context, suffix=self.suffix, fake_history=self.fake_history)
+
+    def split(self, functions: List[Function]) -> List[List[Function]]:
+        """Split the functions into the parts of a sharded mockup: by header or into a number of similar sized parts"""
+        if self.shards == "header":
+            parts = {}
+            for function in functions:
+                parts.setdefault(self.origins.get(function.name) or "", []).append(function)
+            return [parts[header] for header in sorted(parts)]
+        size, rest = divmod(len(functions), self.shards)
+        starts = [part * size + min(part, rest) for part in range(self.shards + 1)]
+        return [functions[start:end] for start, end in zip(starts, starts[1:])]
+
+    def render(self, file: Path, part: Optional[int] = None) -> str:
+        return "".join(self.generate(file, part))
+
+    def generate(self, file: Path, part: Optional[int] = None) -> Iterator[str]:
+        """Render the template piece by piece, without holding the whole mockup in memory"""
+        context = self.context()
+        if part is not None:
+            context.update(part=part, functions=self._parts[part])
+        return self.environment.get_template(Path(file).as_posix()).generate(context)
 
     def write(self, outdir: Path) -> None:
-        for file in listdir(f"{self.template_dir}/{self.mockup_style}"):
-            if file.endswith(".j2"):
-                Path(outdir, self.create_out_filename(file)).write_text(self.render(Path(file)))
+        if self.shards and not self.part_templates():
+            self.logger.warning(f"Mockup style {self.mockup_style} cannot be sharded")
+        for file, part in self.files():
+            path = Path(outdir, self.create_out_filename(file, part))
+            fingerprint = None
+            if self.rendered is not None:
+                fingerprint = self.fingerprint(file, part)
+                if self.rendered.get(str(path.absolute())) == fingerprint and path.is_file():
+                    self.logger.debug(f"{path} is up to date")
+                    continue
+            with Profile.phase("render", file=str(path)) as counters:
+                counters["written"] = self.write_if_different(path, self.generate(Path(file), part))
+            if fingerprint is not None:
+                self.rendered[str(path.absolute())] = fingerprint
+
+    def fingerprint(self, file: str, part: Optional[int] = None) -> str:
+        """Hash of the template and the variables it is rendered with"""
+        context = self.context()
+        functions = self._parts[part] if part is not None else context["functions"]
+        return Cache.key(str(self.style_dir / file), [os.stat(self.style_dir / template).st_mtime_ns for template in self.templates()],
+                         context["headers"], [variable.to_record() for variable in context["variables"]],
+                         [function.to_record() for function in functions], context["parts"], part, self.suffix,
+                         self.fake_history)
+
+    def templates(self) -> List[str]:
+        return sorted(file for file in listdir(self.style_dir) if file.endswith(".j2")) + self.part_templates()
+
+    def part_templates(self) -> List[str]:
+        """The templates rendered once for every part of a sharded mockup"""
+        if not self.shards:
+            return []
+        parts_dir = self.style_dir / "parts"
+        if not parts_dir.is_dir():
+            return []
+        return sorted(f"parts/{file}" for file in listdir(parts_dir) if file.endswith(".j2"))
+
+    def files(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """The templates to render, with the part they are rendered for"""
+        for file in self.templates():
+            if file.startswith("parts/"):
+                yield from ((file, part) for part in self.context()["parts"])
+            else:
+                yield file, None
+
+    def outputs(self, outdir: Path) -> List[Path]:
+        return [Path(outdir, self.create_out_filename(file, part)) for file, part in self.files()]
 
-    def create_out_filename(self, template_filename: str):
+    @staticmethod
+    def write_if_different(path: Path, content: Union[str, Iterable[str]]) -> bool:
+        """
+        Write the file only if its content changes, so that its timestamp does not trigger needless rebuilds.
+        The file is replaced atomically, so that parallel builds never read a partially written file.
+        The content can be streamed as pieces; they are written through a buffer of bounded size.
+        """
+        import filecmp
+        import tempfile
+        handle, temp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w", buffering=MockupWriter.chunk_size) as file:
+                if isinstance(content, str):
+                    file.write(content)
+                else:
+                    file.writelines(content)
+            if path.is_file() and filecmp.cmp(temp, path, shallow=False):
+                os.unlink(temp)
+                return False
+            os.chmod(temp, Cache.file_mode(path))
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return True
+
+    def create_out_filename(self, template_filename: str, part: Optional[int] = None):
         template = Path(Path(template_filename).stem)
-        return template.stem + (self.suffix if self.suffix else "") + template.suffix
+        return template.stem + (self.suffix if self.suffix else "") + (f"_part{part}" if part is not None else "") + template.suffix
 
     def default_language_mode(self) -> str:
-        return 'c++' if self.mockup_style in ["gmock"] else 'c'
+        if self.style_dir.parent == Path(self.template_dir):
+            return 'c++' if self.mockup_style in ["gmock"] else 'c'
+        # Custom templates: C++ if any of them creates a C++ source
+        return 'c++' if any(Path(Path(file).stem).suffix in [".cc", ".cpp", ".cxx"] for file in self.templates()) else 'c'
 
 
 class Hammock:
-    def __init__(self, symbols: Set[str], cmd_args: List[str] = [], mockup_style="gmock", suffix=None):
+    index = None
+    pch_index_ = None
+    translation_units = None  # Set to a dict to keep translation units loaded for reuse (server mode)
+    max_translation_units = 64  # The least recently used ones beyond are disposed of
+    memo = None  # Set to a dict to share the declarations of the sources between the targets of a batch
+
+    def __init__(self, symbols: Set[str], cmd_args: List[str] = [], mockup_style="gmock", suffix=None, cache: Optional[Cache] = None,
+                 shards: Union[int, str, None] = None, fake_history: int = 8):
+        LibClang.import_cindex()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.symbols = symbols
-        self.cmd_args = cmd_args
-        self.writer = MockupWriter(mockup_style, suffix)
+        self.cmd_args = list(cmd_args)
+        self.writer = MockupWriter(mockup_style, suffix, shards, fake_history)
+        self.outputs = []  # Further writers with their output directory, rendering the same declarations
         self.exclude_pathes = []
+        self.cache = cache
+        self.preludes = []
+        self.temporary = None
+        self.includes = {}  # All files the declarations were read from, in order
+        self.history = None  # History of the sources, to parse the ones declaring the most symbols first
+        self.combine = False  # Parse the include directives of the sources of a directory as one translation unit first
 
     def add_excludes(self, pathes: Iterable[str]) -> None:
         self.exclude_pathes.extend(pathes)
 
-    def read(self, sources: List[Path]) -> None:
+    def read(self, sources: List[Path], jobs: int = 1) -> None:
+        if self.combine and len(sources) > 1:
+            sources = self.read_combined(sources)
+            if self.done:
+                return
+        if jobs > 1 and len(sources) > 1:
+            if self.history is not None:
+                self.logger.warning(f"The history is neither used nor updated when parsing with {jobs} jobs")
+            self.read_parallel(sources, jobs)
+            return
+        if self.history is not None and len(sources) > 1:
+            self.read_learned(sources)
+            return
         for source in sources:
             if self.done:
                 break
             self.logger.debug(f"Parsing {source}")
             self.parse(source)
 
+    def read_combined(self, sources: List[Path]) -> List[Path]:
+        """
+        Parse the combined translation units and the sources that are not combined in the order of the sources.
+        If a combined translation unit does not compile, its sources are parsed one by one instead. Returns the
+        combined sources still to be parsed for the remaining symbols, e.g. the ones declared in a source itself.
+        """
+        combined_at = {combined.sources[0]: combined for combined in Combined.detect(sources)}
+        in_combined = {source for combined in combined_at.values() for source in combined.sources}
+        remaining = []
+        for source in sources:
+            if self.done:
+                break
+            if source not in in_combined:
+                self.logger.debug(f"Parsing {source}")
+                self.parse(source)
+                continue
+            combined = combined_at.get(source)
+            if combined is None:
+                continue
+            with Profile.phase("source", source=str(combined.path), sources=len(combined.sources)) as counters:
+                with Profile.phase("parse", source=str(combined.path)):
+                    parseOpts = self.parse_options(combined.path)
+                    parseOpts["unsaved_files"] = [(combined.path, combined.content)]
+                    translation_unit = self.create_translation_unit(parseOpts)
+                if any(diagnostic.severity >= Diagnostic.Error for diagnostic in translation_unit.diagnostics):
+                    self.logger.debug(f"Combined sources not parsed: {list(translation_unit.diagnostics)}")
+                    counters["failed"] = True
+                else:
+                    resolved = len(self.symbols)
+                    self.add_declarations(self.declarations_in(translation_unit, self.symbols, combined.path.parent.absolute()))
+                    counters["resolved"] = resolved - len(self.symbols)
+                    remaining += combined.sources
+                    continue
+            for combined_source in combined.sources:
+                if self.done:
+                    break
+                self.logger.debug(f"Parsing {combined_source}")
+                self.parse(combined_source)
+        return remaining
+
+    def read_parallel(self, sources: List[Path], jobs: int) -> None:
+        """
+        Parse the sources in worker processes. The declarations are added in the order of the sources,
+        so that the same declaration is mocked as when reading the sources one after another.
+        No more sources are handed out, once all remaining symbols are declared in the finished ones.
+        """
+        pending = {}  # source index -> future
+        finished = {}  # source index -> declarations
+        submitted = added = 0
+        worker_args = (LibClang.library_file, LibClang.library_path, self.cmd_args, self.writer.mockup_style, self.cache,
+                       self.preludes, Profile.active.start if Profile.active is not None else None)
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        pool = ProcessPoolExecutor(jobs, initializer=Hammock.init_worker, initargs=worker_args)
+        try:
+            while added < len(sources) and not self.done:
+                while submitted < len(sources) and len(pending) < jobs and not self.declared_in(finished.values()):
+                    self.logger.debug(f"Parsing {sources[submitted]}")
+                    pending[submitted] = pool.submit(Hammock.extract_in_worker, sources[submitted], set(self.symbols))
+                    submitted += 1
+                if added not in pending and added not in finished:
+                    break  # All remaining symbols are declared in sources that are already added
+                wait(pending.values(), return_when=FIRST_COMPLETED)
+                for index, future in list(pending.items()):
+                    if future.done():
+                        finished[index], events = future.result()
+                        if Profile.active is not None:
+                            Profile.active.events += events
+                        del pending[index]
+                while added in finished:
+                    self.add_declarations(finished.pop(added))
+                    added += 1
+        finally:
+            pool.shutdown(cancel_futures=True)
+            if self.cache is not None:
+                self.cache.written = True  # By the workers, on their copies of the cache
+
+    def read_learned(self, sources: List[Path]) -> None:
+        """
+        Parse the sources in the order of the number of remaining symbols they declared last time, until the
+        declaration of every symbol is known to be the one of the first source declaring it. The declarations
+        are added in the order of the sources, so that the same declarations are mocked as without history.
+        """
+        symbols = set(self.symbols)
+        # The exact arguments of each parse, with the language mode and the precompiled prelude
+        args = [list(self.parse_options(source, self.prelude(source))["args"]) for source in sources]
+        entries = [self.history.entry(source, source_args) for source, source_args in zip(sources, args)]
+        order = sorted(range(len(sources)), key=lambda index: -len(symbols.intersection(entries[index][0]["declared"]))
+                       if entries[index][0] else 0)
+        parsed = {}  # source index -> declarations
+        undecided = set(symbols)
+        for index in order:
+            undecided = {symbol for symbol in undecided if not self.decided(symbol, parsed, entries)}
+            if not undecided:
+                break
+            self.logger.debug(f"Parsing {sources[index]}")
+            with Profile.phase("source", source=str(sources[index])):
+                parsed[index] = self.declarations_of(sources[index])
+            self.history.record(sources[index], args[index], parsed[index], symbols)
+        self.logger.debug(f"Parsed {len(parsed)} of {len(sources)} sources")
+        for index, (entry, valid) in enumerate(entries):
+            if index in parsed:
+                self.add_declarations(parsed[index])
+            elif valid:  # Trusted that it declares none of the remaining symbols
+                self.includes.update(dict.fromkeys(entry["files"]))
+
+    @staticmethod
+    def decided(symbol: str, parsed: Dict[int, Declarations], entries: List[Tuple[Optional[dict], bool]]) -> bool:
+        """Is the first source declaring the symbol parsed (or known that no source declares it)?"""
+        for index, (entry, valid) in enumerate(entries):
+            if index in parsed:
+                if symbol in parsed[index].symbols:
+                    return True
+            elif not valid or symbol not in entry["checked"] or symbol in entry["declared"]:
+                return False
+        return True
+
+    def declared_in(self, declarations: Iterable[Declarations]) -> bool:
+        """Are all remaining symbols declared in the given declarations?"""
+        remaining = set(self.symbols)
+        for declaration in declarations:
+            remaining.difference_update(declaration.symbols)
+        return not remaining
+
+    worker = None
+
+    @staticmethod
+    def init_worker(library_file: Optional[str], library_path: Optional[str], cmd_args: List[str], mockup_style: str,
+                    cache: Optional[Cache], preludes: List[Prelude], profile_start: Optional[float] = None) -> None:
+        if profile_start is not None:
+            Profile.active = Profile(None, profile_start, "hammocking worker")
+        LibClang.configure(library_file, library_path)
+        LibClang.load()
+        Hammock.worker = Hammock(set(), cmd_args, mockup_style, cache=cache)
+        Hammock.worker.preludes = preludes
+
+    @staticmethod
+    def extract_in_worker(source: Path, symbols: Set[str]) -> Tuple[Declarations, List[dict]]:
+        """The declarations of the source and the profile events recorded for it (and before) in this worker"""
+        worker = Hammock.worker
+        with Profile.phase("source", source=str(source)):
+            if worker.cache is not None:
+                declarations = worker.extract_cached(source)
+            else:
+                declarations = worker.extract(source, symbols)
+        return declarations, Profile.active.take_events() if Profile.active is not None else []
+
     @staticmethod
     def iter_children(cursor: Cursor) -> Iterator[Cursor]:
         """
         Iterate the direct children of the cursor (usually called with a translation unit), but dive into namepsaces like extern "C" {
         """
+        LibClang.import_cindex()
         for child in cursor.get_children():
             if child.spelling:
                 yield child
-            elif child.kind == CursorKind.UNEXPOSED_DECL: # if cursor is 'extern "C" {', loop inside
+            elif child.kind in (CursorKind.UNEXPOSED_DECL, CursorKind.LINKAGE_SPEC): # if cursor is 'extern "C" {', loop inside
                 for subchild in Hammock.iter_children(child):
                     yield subchild
 
     def parse(self, input: Union[Path, str]) -> None:
+        self.logger.debug(f"Symbols to be mocked: {self.symbols}")
+        with Profile.phase("source", source=str(input) if issubclass(type(input), Path) else "<string>") as counters:
+            declarations = self.declarations_of(input)
+            remaining = len(self.symbols)
+            self.add_declarations(declarations)
+            counters["resolved"] = remaining - len(self.symbols)
+
+    def declarations_of(self, input: Union[Path, str]) -> Declarations:
+        """The declarations of the remaining symbols (or all symbols) in the input, shared or cached if possible"""
+        if Hammock.memo is not None and issubclass(type(input), Path):
+            key = (input.absolute().as_posix(), tuple(self.parse_options(input, self.prelude(input))["args"]))
+            if key not in Hammock.memo:
+                Hammock.memo[key] = self.extract_cached(input) if self.cache is not None else self.extract(input)
+            return Hammock.memo[key]
+        if self.cache is not None and issubclass(type(input), Path):
+            return self.extract_cached(input)
+        return self.extract(input, self.symbols)
+
+    def add_declarations(self, declarations: Declarations) -> None:
+        """Mock the symbols that are still to be mocked and are declared"""
+        self.includes.update(dict.fromkeys(declarations.includes))
+        for name, declaration in declarations.symbols.items():
+            if name not in self.symbols:
+                continue
+            if declaration["file"].startswith(tuple(self.exclude_pathes)):
+                self.logger.debug("Not mocking symbol " + name)
+            else:
+                self.logger.debug(f"Found {name} in {declaration['file']}")
+                if declaration["header"] is not None:
+                    self.writer.add_header(declaration["header"])
+                if declaration["kind"] == "variable":
+                    self.writer.add_variable(Variable.from_record(declaration["record"]))
+                elif declaration["kind"] == "function":
+                    self.writer.add_function(Function.from_record(declaration["record"]), declaration["header"] or declaration["file"])
+                else:
+                    self.logger.warning(f"Unknown kind of symbol: {declaration['kind']}")
+            self.symbols.remove(name)
+
+    def prepare_preludes(self, sources: List[Path], header: Optional[Path] = None) -> None:
+        """
+        Precompile the given prelude header for all sources, or the includes that the sources of
+        a directory have in common.
+        """
+        preludes = [Prelude(header, sources)] if header else Prelude.detect(sources)
+        if self.cache is None and preludes:
+            import tempfile
+            self.temporary = tempfile.TemporaryDirectory()
+        args = self.parse_options(sources[0])["args"]
+        with Profile.phase("prelude", preludes=len(preludes)):
+            self.preludes = [prelude for prelude in preludes
+                             if prelude.build(self.pch_index(), args, self.cache, Path(self.temporary.name if self.temporary else "."))]
+
+    def prelude(self, input: Union[Path, str]) -> Optional[Prelude]:
+        for prelude in self.preludes:
+            if input in prelude.sources:
+                return prelude
+        return None
+
+    @classmethod
+    def pch_index(cls) -> Index:
+        """Index for translation units with precompiled headers, which must not exclude their declarations"""
+        if cls.pch_index_ is None:
+            LibClang.load()
+            cls.pch_index_ = Index.create()
+        return cls.pch_index_
+
+    def parse_options(self, input: Union[Path, str], prelude: Optional[Prelude] = None) -> dict:
         parseOpts = {
             "args": self.cmd_args,
             "options": TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | TranslationUnit.PARSE_INCOMPLETE,
@@ -299,63 +1565,266 @@ class Hammock:
         if issubclass(type(input), Path):
             # Read a path
             parseOpts["path"] = input
-            basepath = input.parent.absolute()
         else:
             # Interpret a string as content of the file
             parseOpts["path"] = "~.c"
             parseOpts["unsaved_files"] = [("~.c", input)]
-            basepath = Path.cwd()
+        if prelude is not None:
+            parseOpts["args"] = parseOpts["args"] + ["-include-pch", str(prelude.pch)]
+        return parseOpts
 
-        self.logger.debug(f"Symbols to be mocked: {self.symbols}")
-        translation_unit = Index.create(excludeDecls=True).parse(**parseOpts)
+    def extract(self, input: Union[Path, str], symbols: Optional[Iterable[str]] = None) -> Declarations:
+        """
+        Parse the input and collect the declarations of the given symbols (or of all symbols).
+        """
+        prelude = self.prelude(input)
+        basepath = input.parent.absolute() if issubclass(type(input), Path) else Path.cwd()
+        source = str(input) if issubclass(type(input), Path) else "<string>"
+        with Profile.phase("parse", source=source, prelude=prelude is not None):
+            if prelude is not None:
+                parseOpts = self.parse_options(input, prelude)
+                translation_unit = self.create_translation_unit(parseOpts, self.pch_index())
+                if any(diagnostic.severity >= Diagnostic.Fatal for diagnostic in translation_unit.diagnostics):
+                    self.logger.debug(f"Precompiled prelude not usable for {input}: {list(translation_unit.diagnostics)}")
+                    prelude = None
+            if prelude is None:
+                parseOpts = self.parse_options(input)
+                translation_unit = self.create_translation_unit(parseOpts)
         self.logger.debug(f"Parse diagnostics: {list(translation_unit.diagnostics)}")
         self.logger.debug(f"Command arguments: {parseOpts['args']}")
-        for child in self.iter_children(translation_unit.cursor):
-            if child.spelling in self.symbols:
-                if any(map(lambda prefix: child.location.file.name.startswith(prefix), self.exclude_pathes)):
-                    self.logger.debug("Not mocking symbol " + child.spelling)
+        return self.declarations_in(translation_unit, symbols, basepath, prelude)
+
+    def declarations_in(self, translation_unit: TranslationUnit, symbols: Optional[Iterable[str]], basepath: Path,
+                        prelude: Optional[Prelude] = None) -> Declarations:
+        """Collect the declarations of the given symbols (or of all symbols) in a parsed translation unit"""
+        with Profile.phase("traverse", source=translation_unit.spelling) as counters:
+            declarations = Declarations()
+            visited = 0
+            for visited, child in enumerate(self.iter_children(translation_unit.cursor), 1):
+                if child.spelling in declarations.symbols or (symbols is not None and child.spelling not in symbols):
+                    continue
+                file = child.location.file.name if child.location.file else translation_unit.spelling
+                if prelude is not None:
+                    file = prelude.names.get(file, file)
+                header = None
+                if file != translation_unit.spelling:  # We found it in the Source itself. Better not include the whole source!
+                    header = file
+                    if header.startswith("./"):   # Replace reference to current directory with CWD's path
+                        header = (basepath / header[2:]).as_posix()
+                if child.kind == CursorKind.VAR_DECL:
+                    declarations.add(child.spelling, "variable", file, header, Variable(child).to_record())
+                elif child.kind == CursorKind.FUNCTION_DECL:
+                    declarations.add(child.spelling, "function", file, header, Function(child).to_record())
                 else:
-                    self.logger.debug(f"Found {child.spelling} in {child.location.file}")
-                    in_header = child.location.file.name != translation_unit.spelling
-                    if in_header:  # We found it in the Source itself. Better not include the whole source!
-                        headerpath = child.location.file.name
-                        if headerpath.startswith("./"):   # Replace reference to current directory with CWD's path
-                            headerpath = (basepath / headerpath[2:]).as_posix()
-                        self.writer.add_header(headerpath)
-                    if child.kind == CursorKind.VAR_DECL:
-                        self.writer.add_variable(child)
-                    elif child.kind == CursorKind.FUNCTION_DECL:
-                        self.writer.add_function(child)
-                    else:
-                        self.logger.warning(f"Unknown kind of symbol: {child.kind}")
-                self.symbols.remove(child.spelling)
+                    declarations.add(child.spelling, str(child.kind), file, header)
+            counters.update(cursors=visited, declarations=len(declarations.symbols))
+        declarations.includes = list(dict.fromkeys(
+            [translation_unit.spelling] + [include.include.name for include in translation_unit.get_includes()]
+            + (prelude.includes if prelude is not None else [])))
+        return declarations
+
+    def extract_cached(self, source: Path) -> Declarations:
+        """
+        Look up the declarations of a source in the cache and extract and store them, if not found.
+        The manifest entry lists the files the source included last time, the declarations entry is
+        addressed by the content of all these files.
+        """
+        args = self.parse_options(source, self.prelude(source))["args"]
+        manifest_key = Cache.key("manifest", Cache.versions(), source.absolute().as_posix(), Cache.file_hash(source),
+                                 self.normalize_arguments(args), os.getcwd())
+        with Profile.phase("cache lookup", source=str(source)) as counters:
+            manifest = self.cache.get(manifest_key)
+            declarations = None
+            if manifest is not None:
+                declarations = self.cache.get(self.declarations_key(manifest_key, manifest["includes"]))
+            counters["hit"] = declarations is not None
+        if declarations is not None:
+            self.logger.debug(f"Using cached declarations of {source}")
+            return Declarations.from_json(declarations)
+        declarations = self.extract(source)
+        self.cache.put(manifest_key, {"includes": declarations.includes})
+        self.cache.put(self.declarations_key(manifest_key, declarations.includes), declarations.to_json())
+        return declarations
+
+    @staticmethod
+    def declarations_key(manifest_key: str, includes: List[str]) -> str:
+        return Cache.key("declarations", manifest_key, [(include, Cache.file_hash(include)) for include in includes])
+
+    @staticmethod
+    def normalize_arguments(args: List[str]) -> List[str]:
+        """Join options and their separate values, so that equivalent command lines give the same list"""
+        normalized = []
+        joinable = ("-I", "-D", "-U", "-x", "-include", "-isystem", "-iquote", "-idirafter")
+        for arg in args:
+            if normalized and normalized[-1] in joinable:
+                normalized[-1] += arg.strip()
+            else:
+                normalized.append(arg.strip())
+        return normalized
+
+    @classmethod
+    def create_translation_unit(cls, parseOpts: dict, index: Optional[Index] = None) -> TranslationUnit:
+        """
+        Parse a translation unit with the shared index.
+        If translation units are kept, an unchanged one is reused and a changed one is reparsed.
+        """
+        if index is None:
+            if cls.index is None:
+                LibClang.load()
+                cls.index = Index.create(excludeDecls=True)
+            index = cls.index
+        if cls.translation_units is None or "unsaved_files" in parseOpts:
+            return index.parse(**parseOpts)
+        key = (Path(parseOpts["path"]).absolute().as_posix(), tuple(parseOpts["args"]), os.getcwd())
+        if key in cls.translation_units:
+            translation_unit, mtimes = cls.translation_units.pop(key)  # Reinserted as the most recently used
+            if mtimes == cls._file_mtimes(mtimes.keys()):
+                cls.translation_units[key] = (translation_unit, mtimes)
+                return translation_unit
+            translation_unit.reparse(options=parseOpts["options"])
+        else:
+            translation_unit = index.parse(**parseOpts)
+        files = [translation_unit.spelling] + [include.include.name for include in translation_unit.get_includes()]
+        cls.translation_units[key] = (translation_unit, cls._file_mtimes(files))
+        while len(cls.translation_units) > cls.max_translation_units:
+            del cls.translation_units[next(iter(cls.translation_units))]
+        return translation_unit
+
+    @staticmethod
+    def _file_mtimes(files: Iterable[str]) -> Dict[str, Optional[int]]:
+        mtimes = {}
+        for file in files:
+            try:
+                mtimes[file] = os.stat(file).st_mtime_ns
+            except OSError:
+                mtimes[file] = None
+        return mtimes
+
+    def add_output(self, writer: MockupWriter, outdir: Path) -> None:
+        """Render the declarations with another writer, e.g. in another style, as well"""
+        writer.share(self.writer)
+        self.outputs.append((writer, outdir))
 
     def write(self, outdir: Path) -> None:
         self.writer.write(outdir)
+        for writer, directory in self.outputs:
+            writer.write(directory)
+        if self.cache is not None and self.cache.written:
+            self.cache.evict()
 
     @property
     def done(self) -> bool:
         return len(self.symbols) == 0
 
 
+class ElfReader:
+    """
+    Read the undefined global symbols of ELF relocatable objects and of ar archives of them
+    directly from their symbol tables, the way nm reports them with "U".
+    """
+    SHT_SYMTAB = 2
+    STB_GLOBAL = 1
+    SHN_UNDEF = 0
+
+    @staticmethod
+    def supports(path: Path) -> bool:
+        try:
+            with open(path, "rb") as file:
+                magic = file.read(8)
+        except OSError:
+            return False
+        return magic[:4] == b"\x7fELF" or magic == b"!<arch>\n"
+
+    @classmethod
+    def undefined_symbols(cls, path: Path) -> List[str]:
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:8] == b"!<arch>\n":
+                return [symbol for offset, size in cls._archive_members(data) if data[offset:offset + 4] == b"\x7fELF"
+                        for symbol in cls._elf_undefined_symbols(data, offset)]
+            return cls._elf_undefined_symbols(data, 0)
+
+    @staticmethod
+    def _archive_members(data: mmap.mmap) -> Iterator[Tuple[int, int]]:
+        """Offset and size of the members of an ar archive"""
+        offset = 8
+        while offset + 60 <= len(data):
+            name = data[offset:offset + 16].rstrip()
+            size = int(data[offset + 48:offset + 58])
+            offset += 60
+            if name.startswith(b"#1/"):  # BSD: the name precedes the content
+                name_size = int(name[3:])
+                yield offset + name_size, size - name_size
+            elif name not in (b"/", b"//", b"/SYM64/"):  # GNU symbol tables and long name table
+                yield offset, size
+            offset += size + (size & 1)
+
+    @classmethod
+    def _elf_undefined_symbols(cls, data: mmap.mmap, base: int) -> List[str]:
+        is_64 = data[base + 4] == 2
+        endian = "<" if data[base + 5] == 1 else ">"
+        if is_64:
+            shoff, = struct.unpack_from(endian + "Q", data, base + 0x28)
+            shentsize, shnum = struct.unpack_from(endian + "HH", data, base + 0x3A)
+            section_format, symbol_format = endian + "IIQQQQIIQQ", endian + "IBBHQQ"
+        else:
+            shoff, = struct.unpack_from(endian + "I", data, base + 0x20)
+            shentsize, shnum = struct.unpack_from(endian + "HH", data, base + 0x2E)
+            section_format, symbol_format = endian + "IIIIIIIIII", endian + "IIIBBH"
+        sections = []
+        for index in range(shnum):
+            section = struct.unpack_from(section_format, data, base + shoff + index * shentsize)
+            sections.append(section)  # name, type, flags, addr, offset, size, link, ...
+        symbols = []
+        for _, sh_type, _, _, offset, size, link, *_ in sections:
+            if sh_type != cls.SHT_SYMTAB:
+                continue
+            strtab = base + sections[link][4]
+            table = memoryview(data)[base + offset:base + offset + size]
+            try:
+                for entry in struct.iter_unpack(symbol_format, table):
+                    if is_64:
+                        name, info, _, shndx, _, _ = entry
+                    else:
+                        name, _, _, info, _, shndx = entry
+                    if name and shndx == cls.SHN_UNDEF and info >> 4 == cls.STB_GLOBAL:
+                        symbols.append(data[strtab + name:data.find(b"\0", strtab + name)].decode())
+            finally:
+                table.release()
+        return symbols
+
+
 class NmWrapper:
     nmpath = "nm"
+    backend = "auto"  # "native" reads ELF objects and archives directly, "nm" always runs nm
     includepattern = None
     excludepattern = r"^__gcov"
     if sys.platform == 'darwin':  # Mac objects have an additional _
         pattern = r"\s*U\s+_(\S*)"
     else:
         pattern = r"\s*U\s+(\S*)"
+    results = None  # Set to a dict to share the symbols of the objects between the targets of a batch
+    _matcher = None
 
-    def __init__(self, plink: Path):
+    def __init__(self, plink: Union[Path, List[Path]], cache: Optional[Cache] = None):
         self.plink = plink
-        self.undefined_symbols = []
-        self.__process()
+        self.cache = cache
+        plinks = plink if isinstance(plink, list) else [plink]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor() as pool:
+            scanned = list(pool.map(self.scan, plinks))
+        matcher = self.matcher()
+        self.undefined_symbols = [symbol for symbol in dict.fromkeys(chain.from_iterable(scanned)) if matcher.match(symbol)]
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"{len(self.undefined_symbols)} undefined symbols to be mocked: {self.undefined_symbols}")
 
     @classmethod
     def set_nm_path(cls, path: str) -> None:
         cls.nmpath = path
 
+    @classmethod
+    def set_backend(cls, backend: str) -> None:
+        cls.backend = backend
+
     @classmethod
     def set_include_pattern(cls, pattern: str) -> None:
         cls.includepattern = re.compile(pattern)
@@ -364,77 +1833,625 @@ class NmWrapper:
     def set_exclude_pattern(cls, pattern: str) -> None:
         cls.excludepattern = re.compile(pattern)
 
+    @classmethod
+    def matcher(cls) -> re.Pattern:
+        """The include and exclude patterns, compiled into one expression that matches the symbols to be mocked"""
+        patterns = (cls.includepattern, cls.excludepattern)
+        if cls._matcher is None or cls._matcher[0] != patterns:
+            include, exclude = (getattr(pattern, "pattern", pattern) for pattern in patterns)
+            alternatives = [f"(?:{include})"] if include is not None else []
+            alternatives.append(f"(?!{exclude})" if exclude is not None else "")
+            cls._matcher = (patterns, re.compile("|".join(alternatives)))
+        return cls._matcher[1]
+
     def get_undefined_symbols(self) -> Set[str]:
         return set(self.undefined_symbols)
 
-    def __process(self):
-        with Popen(
-                [NmWrapper.nmpath, self.plink],
-                stdout=PIPE,
-                stderr=PIPE,
-                bufsize=1,
-                universal_newlines=True,
-        ) as p:
-            for line in p.stdout:
-                symbol = self.mock_it(line)
-                if symbol is not None:
-                    self.undefined_symbols.append(symbol)
-            assert p.returncode is None
+    def scan(self, plink: Path) -> List[str]:
+        """
+        All undefined symbols of an object or archive. They are cached by the object's size and
+        modification time and, if these changed, by its content.
+        """
+        stat = plink.stat()
+        key = (plink.absolute().as_posix(), stat.st_size, stat.st_mtime_ns, NmWrapper.backend, NmWrapper.nmpath)
+        if NmWrapper.results is not None and key in NmWrapper.results:
+            return NmWrapper.results[key]
+        with Profile.phase("nm", object=str(plink)) as counters:
+            symbols = self.read_symbols_cached(plink, key)
+            counters["symbols"] = len(symbols)
+        if NmWrapper.results is not None:
+            NmWrapper.results[key] = symbols
+        return symbols
+
+    def read_symbols_cached(self, plink: Path, key: tuple) -> List[str]:
+        symbols = None
+        if self.cache is not None:
+            stat_key = Cache.key("nm-stat", *key)
+            content = self.cache.get(stat_key)
+            content_hash = content["hash"] if content is not None else Cache.file_hash(plink)
+            symbols_key = Cache.key("nm", content_hash, NmWrapper.backend, NmWrapper.nmpath)
+            symbols = self.cache.get(symbols_key)
+            if symbols is None:
+                symbols = self.read_symbols(plink)
+                self.cache.put(symbols_key, symbols)
+            if content is None:
+                self.cache.put(stat_key, {"hash": content_hash})
+        else:
+            symbols = self.read_symbols(plink)
+        return symbols
+
+    @classmethod
+    def read_symbols(cls, plink: Path) -> List[str]:
+        if cls.backend != "nm" and ElfReader.supports(plink):
+            return ElfReader.undefined_symbols(plink)
+        command = [cls.nmpath, plink] if sys.platform == 'darwin' else [cls.nmpath, "--undefined-only", plink]
+        from subprocess import Popen, PIPE
+        with Popen(command, stdout=PIPE, stderr=PIPE, universal_newlines=True) as p:
+            output, _ = p.communicate()
+        pattern = re.compile(cls.pattern)
+        return [match.group(1) for match in map(pattern.match, output.splitlines()) if match]
 
     @classmethod
     def mock_it(cls, symbol: str) -> Optional[str]:
         if match := re.match(cls.pattern, symbol):
-            symbol = match.group(1)
-            if cls.includepattern is not None and re.match(cls.includepattern, symbol) is not None:
-                logging.debug(symbol + " to be mocked (via include pattern)")
-                return symbol
-            elif cls.excludepattern is None or re.match(cls.excludepattern, symbol) is None:
-                logging.debug(symbol + " to be mocked")
-                return symbol
-            else:
-                logging.debug(symbol + " is excluded")
+            return cls.select(match.group(1))
+        return None
+
+    @classmethod
+    def select(cls, symbol: str) -> Optional[str]:
+        """Apply the include and exclude patterns to an undefined symbol"""
+        if cls.matcher().match(symbol):
+            logging.debug(symbol + " to be mocked")
+            return symbol
+        logging.debug(symbol + " is excluded")
         return None
 
 
-def main(pargv):
+class Server:
+    """
+    Serve mockup runs on a Unix socket, keeping libclang, the Jinja environments and the parsed
+    translation units loaded between the runs. Requests are served one after another, as a run
+    changes the working directory, the standard streams and class attributes of the process.
+    Only the user running the server can connect to the socket.
+    """
+
+    def __init__(self, socket_path: Path):
+        self.socket_path = Path(socket_path)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.nm_settings = (NmWrapper.nmpath, NmWrapper.backend, NmWrapper.includepattern, NmWrapper.excludepattern)
+
+    @staticmethod
+    def default_socket_path() -> Path:
+        if "HAMMOCKING_SOCKET" in environ:
+            return Path(environ["HAMMOCKING_SOCKET"])
+        if "XDG_RUNTIME_DIR" in environ:
+            return Path(environ["XDG_RUNTIME_DIR"]) / "hammocking.sock"
+        return Server.private_directory() / "hammocking.sock"
+
+    @staticmethod
+    def private_directory() -> Path:
+        """Directory of the default socket if there is no runtime directory, only accessible by the user"""
+        import tempfile
+        return Path(tempfile.gettempdir()) / f"hammocking-{os.getuid()}"
+
+    def serve_forever(self) -> None:
+        import socket
+        Hammock.translation_units = {}
+        directory = self.socket_path.parent
+        if directory == self.private_directory():
+            directory.mkdir(mode=0o700, exist_ok=True)
+            status = directory.stat()
+            if status.st_uid != os.getuid() or stat.S_IMODE(status.st_mode) & 0o077:
+                raise PermissionError(f"{directory} must be owned by and only be accessible by the user running the server")
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            umask = os.umask(0o177)  # Connecting needs write permission, which only the user gets
+            try:
+                server.bind(str(self.socket_path))
+            finally:
+                os.umask(umask)
+            server.listen()
+            self.logger.info(f"Serving on {self.socket_path}")
+            try:
+                running = True
+                while running:
+                    connection, _ = server.accept()
+                    with connection:
+                        running = self.serve(connection)
+            finally:
+                self.socket_path.unlink()
+
+    def serve(self, connection: socket.socket) -> bool:
+        """Answer the request of a connection, a malformed one with an error. Returns whether to go on serving."""
+        running = True
+        try:
+            request = json.loads(self.receive(connection))
+            if not isinstance(request, dict):
+                raise ValueError("the request must be a JSON object")
+            running = request.get("command") != "shutdown"
+            response = self.handle(request)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self.logger.warning(f"Invalid request: {e!r}")
+            response = {"exit": 1, "stdout": "", "stderr": f"Invalid request to the hammocking server: {e!r}\n"}
+        try:
+            connection.sendall(json.dumps(response).encode())
+        except OSError as e:  # The client is gone
+            self.logger.warning(f"Could not answer the request: {e!r}")
+        return running
+
+    @staticmethod
+    def receive(connection: socket.socket) -> bytes:
+        chunks = []
+        while chunk := connection.recv(65536):
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def handle(self, request: dict) -> dict:
+        """Run hammocking with the request's arguments in the request's working directory"""
+        if request.get("command") == "shutdown":
+            return {"exit": 0, "stdout": "", "stderr": ""}
+        NmWrapper.nmpath, NmWrapper.backend, NmWrapper.includepattern, NmWrapper.excludepattern = self.nm_settings
+        stdout, stderr = io.StringIO(), io.StringIO()
+        handler = logging.StreamHandler(stderr)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root = logging.getLogger()
+        handlers, level = root.handlers, root.level
+        root.handlers = [handler]
+        cwd = os.getcwd()
+        try:
+            os.chdir(request["cwd"])
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    exit_code = run(request["argv"])
+                except SystemExit as e:  # argparse errors
+                    exit_code = e.code
+                except Exception as e:
+                    logging.exception(e)
+                    exit_code = 1
+        finally:
+            os.chdir(cwd)
+            root.handlers = handlers
+            root.setLevel(level)
+        return {"exit": exit_code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+class Watcher:
+    """
+    Create the mockups again whenever one of the files they were created from changes. The declarations of the
+    sources and their translation units are kept between the runs: only the sources including a changed file
+    are parsed again (reparsed by libclang) and only the outputs whose template variables changed are rendered.
+    Changes are noticed with inotify on Linux or by polling the modification times of the files.
+    """
+    active = None  # The watcher of the current run, which collects the files the run depends on
+    # inotify(7) events of a directory that change a file in it
+    events = 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200  # IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    settle_time = 0.05  # Editors and builds change several files at once
+
+    def __init__(self, argv: List[str], backend: str = "auto", interval: float = 0.5) -> None:
+        self.argv = argv
+        self.interval = interval
+        if backend == "auto":
+            backend = "inotify" if sys.platform.startswith("linux") else "poll"
+        self.backend = backend
+        self.files = set()  # Absolute paths of the files the last run depends on
+        self.mtimes = {}
+        self.inotify = None
+        self.directories = {}  # inotify watch descriptor -> directory
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def add(self, files: Iterable[Union[Path, str]]) -> None:
+        self.files.update(os.path.abspath(file) for file in files)
+
+    def watch_forever(self) -> None:
+        Hammock.translation_units, Hammock.memo, NmWrapper.results, MockupWriter.rendered = {}, {}, {}, {}
+        try:
+            while True:
+                self.run_once()
+                self.logger.info(f"Watching {len(self.files)} files")
+                self.invalidate(self.wait())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            Hammock.translation_units, Hammock.memo, NmWrapper.results, MockupWriter.rendered = None, None, None, None
+            self.close()
+
+    def close(self) -> None:
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify, self.directories = None, {}
+
+    def run_once(self) -> int:
+        previous, self.files = self.files, set()
+        self.add(self.inputs())
+        Watcher.active = self
+        try:
+            exit_code = run(self.argv)
+        except Exception as e:  # Keep watching, the next change may fix it
+            logging.exception(e)
+            exit_code = 1
+            self.files.update(previous)  # The run did not get to add the files it depends on
+        finally:
+            Watcher.active = None
+        if self.backend == "inotify":
+            self.watch_directories()
+        else:
+            self.mtimes = self.stat(self.files)
+        return exit_code
+
+    def inputs(self) -> List[Path]:
+        """The files given by the command line: the sources, the objects, the manifest, the configuration and the templates"""
+        try:
+            args, _ = argument_parser().parse_known_args(self.argv)
+        except SystemExit:  # The run reports the error
+            return []
+        files = [*(args.sources or []), *(args.plink or []), *([args.manifest] if args.manifest else []),
+                 *([Path(args.config)] if args.config else [])]
+        for entry in args.style:
+            writer = MockupWriter(MockupWriter.parse_style(entry, None, None)[0], shards=args.shards)
+            if writer.style_dir.is_dir():
+                files += [writer.style_dir / template for template in writer.templates()]
+        return files
+
+    def invalidate(self, changed: Set[str]) -> None:
+        """Forget the declarations of the sources that include a changed file"""
+        self.logger.info(f"Changed: {', '.join(sorted(changed))}")
+        for key, declarations in list((Hammock.memo or {}).items()):
+            if any(os.path.abspath(include) in changed for include in declarations.includes):
+                del Hammock.memo[key]
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """The watched files that changed, as soon as one changed (no files if the timeout passed before)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.read_events() if self.backend == "inotify" else self.poll()
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    @staticmethod
+    def stat(files: Iterable[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        mtimes = {}
+        for file in files:
+            try:
+                status = os.stat(file)
+                mtimes[file] = (status.st_mtime_ns, status.st_size)
+            except OSError:
+                mtimes[file] = None
+        return mtimes
+
+    def poll(self) -> Set[str]:
+        time.sleep(self.interval)
+        mtimes = self.stat(self.files)
+        changed = {file for file, mtime in mtimes.items() if mtime != self.mtimes.get(file)}
+        self.mtimes = mtimes
+        return changed
+
+    def watch_directories(self) -> None:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if self.inotify is None:
+            self.inotify = libc.inotify_init1(os.O_CLOEXEC)
+            if self.inotify < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for directory in set(map(os.path.dirname, self.files)) - set(self.directories.values()):
+            descriptor = libc.inotify_add_watch(self.inotify, os.fsencode(directory), self.events)
+            if descriptor >= 0:
+                self.directories[descriptor] = directory
+
+    def read_events(self) -> Set[str]:
+        """The watched files changed according to the inotify events of the next interval"""
+        import select
+        changed = set()
+        timeout = self.interval
+        while select.select([self.inotify], [], [], timeout)[0]:
+            buffer = os.read(self.inotify, 65536)
+            offset = 0
+            while offset < len(buffer):
+                descriptor, _, _, length = struct.unpack_from("iIII", buffer, offset)
+                name = buffer[offset + 16:offset + 16 + length].rstrip(b"\0")
+                offset += 16 + length
+                if descriptor in self.directories and name:
+                    changed.add(os.path.join(self.directories[descriptor], os.fsdecode(name)))
+            timeout = self.settle_time
+        return changed & self.files
+
+
+def watch(pargv) -> int:
+    """Create the mockups like a normal run and again whenever one of their sources, headers or inputs changes"""
+    arg = ArgumentParser(prog='hammocking watch', epilog="All other arguments are the ones of a normal run.")
+    arg.add_argument("--backend", help="How changes are noticed (auto: inotify on Linux, otherwise polling)",
+                     choices=["auto", "inotify", "poll"], default="auto")
+    arg.add_argument("--interval", help="Seconds between two checks for changes", type=float, default=0.5)
+    args, argv = arg.parse_known_args(pargv)
+    Watcher(argv, args.backend, args.interval).watch_forever()
+    return 0
+
+
+def serve(pargv) -> int:
+    arg = ArgumentParser(prog='hammocking serve')
+    arg.add_argument("--socket", help="Path of the Unix socket to listen on", type=Path, default=Server.default_socket_path())
+    arg.add_argument("--debug", "-d", help="Debugging", required=False, default=False, action="store_true")
+    args = arg.parse_args(pargv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    Server(args.socket).serve_forever()
+    return 0
+
+
+def create_index(pargv) -> int:
+    """Create or update the symbol index of a project's headers"""
+    arg = ArgumentParser(fromfile_prefix_chars="@", prog='hammocking index')
+    arg.add_argument("--index", "-i", help="Index file to create or update", required=True, type=Path)
+    arg.add_argument("--headers", help="List of header files to be indexed", type=Path, required=True, nargs="+")
+    arg.add_argument("--style", "-t", help="Mockup style, which determines the language mode", required=False, default="gmock")
+    arg.add_argument("--debug", "-d", help="Debugging", required=False, default=False, action="store_true")
+    arg.add_argument("--config", help="Configuration file", required=False, default="")
+    args, cmd_args = arg.parse_known_args(args=pargv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
+    ConfigReader(Path(args.config))
+    index = SymbolIndex(args.index)
+    index.update(args.headers, Hammock(set(), cmd_args, mockup_style=args.style))
+    index.save()
+    return 0
+
+
+def argument_parser() -> ArgumentParser:
+    """The parser of the command line of a run"""
     arg = ArgumentParser(fromfile_prefix_chars="@", prog='hammocking')
 
-    group_symbols_xor_plink = arg.add_mutually_exclusive_group(required=True)
+    group_symbols_xor_plink = arg.add_mutually_exclusive_group()
     group_symbols_xor_plink.add_argument("--symbols", "-s", help="Symbols to mock", nargs="+")
-    group_symbols_xor_plink.add_argument("--plink", "-p", help="Path to partially linked object", type=Path)
+    group_symbols_xor_plink.add_argument("--plink", "-p", help="Paths to partially linked objects or archives", type=Path, nargs="+")
 
     arg.add_argument("--debug", "-d", help="Debugging", required=False, default=False, action="store_true")
-    arg.add_argument("--outdir", "-o", help="Output directory", required=True, type=Path)
-    arg.add_argument("--sources", help="List of source files to be parsed", type=Path, required=True, nargs="+")
+    arg.add_argument("--outdir", "-o", help="Output directory", type=Path)
+    arg.add_argument("--sources", help="List of source files to be parsed", type=Path, nargs="+")
+    arg.add_argument("--manifest", help="JSON file with a list of targets to create mockups for, instead of a single one", type=Path)
 
-    arg.add_argument("--style", "-t", help="Mockup style to output", required=False, default="gmock")
+    arg.add_argument("--style", "-t", help="Mockup styles to output (or directories with custom templates) as style[:suffix[:outdir]], "
+                     "the first one determines the language mode", nargs="+", required=False, default=["gmock"])
     arg.add_argument("--suffix", help="Suffix to be added to the generated files", required=False)
+    arg.add_argument("--fake-history", help="Number of calls the fake_c style records per function", type=int, default=8)
+    group_shards = arg.add_mutually_exclusive_group()
+    group_shards.add_argument("--shards", help="Split the mockup into this number of parts to be compiled in parallel", type=int)
+    group_shards.add_argument("--shard-by", help="Split the mockup into one part per header", choices=["header"], dest="shards")
     arg.add_argument("--except", help="Path prefixes that should not be mocked", nargs="*", dest="exclude_pathes", default=["/usr/include"])
     arg.add_argument("--exclude", help="Symbols that should not be mocked", nargs="*", default=[])
     arg.add_argument("--config", help="Configuration file", required=False, default="")
+    arg.add_argument("--cache-dir", help="Directory to cache the declarations found in the sources", type=Path)
+    arg.add_argument("--jobs", "-j", help="Number of sources to parse in parallel", type=int, default=1)
+    arg.add_argument("--prelude", help="Header to precompile for all sources (default: the includes the sources start with)",
+                     nargs="?", const="", type=Path)
+    arg.add_argument("--modules-cache", help="Use clang modules for system headers, cached in this directory", type=Path)
+    arg.add_argument("--index", help="Symbol index (see 'hammocking index') to look up the symbols first", type=Path)
+    arg.add_argument("--stamp", help="Stamp file to skip the run if no input changed since it was written", type=Path)
+    arg.add_argument("--depfile", help="Write the files the mockup depends on to this Makefile style dependency file", type=Path)
+    arg.add_argument("--depfile-target", help="File the dependencies are written for (default: the created files)", type=Path)
+    arg.add_argument("--combine", help="Parse the include directives of the sources of a directory as one translation unit first",
+                     action="store_true")
+    arg.add_argument("--history", help="File to learn in which sources the symbols are declared, to parse these sources first",
+                     type=Path)
+    arg.add_argument("--profile", help="Write the time and memory of each phase as Chrome trace events to this file", type=Path)
+    arg.add_argument("--cprofile", help="Write cProfile statistics of the run to this file", type=Path)
+    arg.add_argument("--compile-db", help="compile_commands.json (or its directory) with the compiler arguments of the sources", type=Path)
+    return arg
+
+
+def run(pargv) -> int:
+    """Create the mockups as requested by the command line and return the exit code"""
+    arg = argument_parser()
     args, cmd_args = arg.parse_known_args(args=pargv)
+    if isinstance(args.shards, int) and args.shards < 1:
+        arg.error("argument --shards: must be at least 1")
+    if args.compile_db and CompileDb.location(args.compile_db).name != "compile_commands.json":
+        arg.error("argument --compile-db: the compilation database must be named compile_commands.json")
+    if args.manifest is None:
+        if not args.symbols and not args.plink:
+            arg.error("one of the arguments --symbols/-s --plink/-p is required")
+        missing = [name for name, value in (("--outdir/-o", args.outdir), ("--sources", args.sources)) if not value]
+        if missing:
+            arg.error("the following arguments are required: " + ", ".join(missing))
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
     config = ConfigReader(Path(args.config))
     args.exclude_pathes += config.exclude_pathes
+
+    if args.modules_cache:
+        cmd_args += ["-fmodules", f"-fmodules-cache-path={args.modules_cache.absolute()}"]
+
+    RenderableType.infos = {}
+    Profile.active = Profile(args.profile) if args.profile else None
+    profiler = None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with Profile.phase("run"):
+            if args.manifest is not None:
+                return run_manifest(args, cmd_args, config)
+            return generate(args, cmd_args, config)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if Profile.active is not None:
+            Profile.active.save()
+            Profile.active = None
+
+
+def target_arguments(args: Namespace, target: dict) -> Namespace:
+    """The arguments of a manifest target, the ones it does not give are taken from the command line"""
+    if not isinstance(target, dict):
+        raise TypeError(f"a target must be a JSON object, not {target!r}")
+    target_args = Namespace(**vars(args))
+    target_args.sources = [Path(source) for source in target["sources"]]
+    target_args.outdir = Path(target["outdir"])
+    target_args.symbols = target.get("symbols")
+    plink = target.get("plink")
+    target_args.plink = [Path(path) for path in ([plink] if isinstance(plink, str) else plink)] if plink else None
+    if not target_args.symbols and not target_args.plink:
+        raise ValueError('one of the keys "symbols" or "plink" is required')
+    style = target.get("style", args.style)
+    target_args.style = [style] if isinstance(style, str) else style
+    target_args.suffix = target.get("suffix", args.suffix)
+    target_args.shards = target.get("shards", args.shards)
+    target_args.exclude = args.exclude + target.get("exclude", [])
+    target_args.stamp = Path(target["stamp"]) if target.get("stamp") else None
+    target_args.depfile = Path(target["depfile"]) if target.get("depfile") else None
+    target_args.depfile_target = None
+    target_args.history = Path(target["history"]) if target.get("history") else None
+    return target_args
+
+
+def run_manifest(args: Namespace, cmd_args: List[str], config: ConfigReader) -> int:
+    """
+    Create the mockups for all targets of a manifest. Each target is given as a JSON object with the keys
+    "sources", "outdir", "symbols" or "plink" (one or a list) and optionally "style", "suffix", "shards", "exclude", "stamp", "depfile", "history" and "args"
+    (extra compiler arguments). The declarations of the sources and the symbols of the objects are shared between the targets.
+    """
+    targets = json.loads(args.manifest.read_text())
+    if isinstance(targets, dict):
+        targets = targets["targets"]
+    shared = Hammock.memo is None  # A watch shares them between its runs already
+    if shared:
+        Hammock.memo, NmWrapper.results = {}, {}
+    failed = 0
+    try:
+        for number, target in enumerate(targets, 1):
+            name = (target.get("name") or target.get("outdir")) if isinstance(target, dict) else None
+            name = name or f"target {number}"
+            try:
+                target_args = target_arguments(args, target)
+            except (KeyError, TypeError, ValueError) as e:
+                reason = f"the key {e} is missing" if isinstance(e, KeyError) else str(e)
+                logging.error(f"{name}: invalid target in {args.manifest}, {reason}")
+                exit_code = 1
+            else:
+                logging.info(f"Creating mockup for {name}")
+                try:
+                    with Profile.phase("target", target=name):
+                        exit_code = generate(target_args, cmd_args + target.get("args", []), config)
+                except Exception as e:
+                    logging.error(f"{name}: {e}")
+                    exit_code = 1
+            if exit_code != 0:
+                sys.stderr.write(f"HammocKing failed for {name}\n")
+                failed += 1
+    finally:
+        if shared:
+            Hammock.memo, NmWrapper.results = None, None
+    return 1 if failed else 0
+
+
+def generate(args: Namespace, cmd_args: List[str], config: ConfigReader) -> int:
+    """Create the mockup of one target and return the exit code"""
+    cache_dir = args.cache_dir or config.cache_dir
+    styles = [MockupWriter.parse_style(entry, args.suffix, args.outdir) for entry in args.style]
+    stamp = None
+    if args.stamp:
+        writers = [(MockupWriter(style, suffix, args.shards, args.fake_history), outdir) for style, suffix, outdir in styles]
+        stamp = Stamp(args.stamp, Stamp.fingerprint(args, cmd_args, config, [writer for writer, _ in writers]))
+        unresolved = stamp.check() if Watcher.active is None else None
+        if unresolved is not None:
+            logging.info(f"Mockup in {args.outdir} is up to date")
+            if args.depfile:
+                Depfile(args.depfile, args.depfile_target).write(stamp.outputs,
+                                                                 dependencies(args, config, [writer for writer, _ in writers], stamp.files))
+            return report(unresolved)
+    cache = Cache(cache_dir, config.cache_size) if cache_dir else None
+    MockupWriter.set_bytecode_cache_dir(Path(cache_dir, "jinja") if cache_dir else None)
     if not args.symbols:
-        args.symbols = NmWrapper(args.plink).get_undefined_symbols()
+        args.symbols = NmWrapper(args.plink, cache).get_undefined_symbols()
 
-    args.symbols -= set(args.exclude)
+    args.symbols = set(args.symbols) - set(args.exclude)
 
     logging.debug("Extra arguments: %s" % cmd_args)
 
-    h = Hammock(symbols=args.symbols, cmd_args=cmd_args, mockup_style=args.style, suffix=args.suffix)
+    (style, suffix, outdir), *others = styles  # The first style determines the language mode of the only parse
+    h = Hammock(symbols=args.symbols, cmd_args=cmd_args, mockup_style=style, suffix=suffix, cache=cache, shards=args.shards,
+                fake_history=args.fake_history)
+    for other_style, other_suffix, other_outdir in others:
+        h.add_output(MockupWriter(other_style, other_suffix, args.shards, args.fake_history), other_outdir)
     h.add_excludes(args.exclude_pathes)
-    h.read(args.sources)
-    h.write(args.outdir)
-
-    if not h.done:
+    h.combine = args.combine
+    h.history = History(args.history) if args.history else None
+    groups = CompileDb(args.compile_db).group(args.sources) if args.compile_db else {(): args.sources}
+    if args.index:
+        index = SymbolIndex(args.index)
+        h.cmd_args = cmd_args + list(next(iter(groups)))
+        if index.matches(h.parse_options(args.sources[0])["args"]):
+            h.add_declarations(index.declarations())
+        else:
+            logging.warning(f"{args.index} was created with other compiler arguments, parsing the sources instead")
+    for arguments, sources in groups.items():
+        if h.done:
+            break
+        h.cmd_args = cmd_args + list(arguments)
+        if args.prelude is not None:
+            h.prepare_preludes(sources, args.prelude if args.prelude != Path("") else None)
+        with Profile.phase("read", sources=len(sources), jobs=args.jobs):
+            h.read(sources, args.jobs)
+    if h.history is not None:
+        h.history.save()
+    with Profile.phase("write", outdir=str(outdir)):
+        h.write(outdir)
+    writers = [(h.writer, outdir)] + h.outputs
+    if args.depfile:
+        Depfile(args.depfile, args.depfile_target).write(outputs(writers),
+                                                         dependencies(args, config, [writer for writer, _ in writers], h.includes))
+    if Watcher.active is not None:
+        Watcher.active.add(dependencies(args, config, [writer for writer, _ in writers], h.includes))
+    if stamp is not None:
+        stamp.write(list(h.includes) + [str(source) for source in args.sources], h.symbols, outputs(writers))
+    return report(h.symbols)
+
+
+def outputs(writers: List[Tuple[MockupWriter, Path]]) -> List[Path]:
+    """The files the writers create in their output directories"""
+    return [path for writer, outdir in writers for path in writer.outputs(outdir)]
+
+
+def dependencies(args: Namespace, config: ConfigReader, writers: List[MockupWriter], files: Iterable[str]) -> List[Union[Path, str]]:
+    """The files a mockup depends on: the files its declarations were read from, the sources and all other inputs"""
+    return list(chain(files, args.sources, args.plink or [], [config.configfile], [args.index] if args.index else [],
+                      [CompileDb.location(args.compile_db)] if args.compile_db else [],
+                      [writer.style_dir / template for writer in writers for template in writer.templates()], [__file__]))
+
+
+def report(unresolved: Iterable[str]) -> int:
+    """Report the symbols that could not be mocked and return the exit code"""
+    if unresolved:
         sys.stderr.write(
-            "HammocKing failed. The following symbols could not be mocked:\n" + "\n".join(h.symbols) + "\n")
-        exit(1)
-    exit(0)
+            "HammocKing failed. The following symbols could not be mocked:\n" + "\n".join(unresolved) + "\n")
+        return 1
+    return 0
+
+
+def main(pargv):
+    commands = {"serve": serve, "index": create_index, "watch": watch}
+    if pargv and pargv[0] in commands:
+        exit(commands[pargv[0]](pargv[1:]))
+    exit(run(pargv))
+
+
+
+def __getattr__(name: str):
+    """The names of clang.cindex, imported when they are first asked for"""
+    if name in LibClang.names:
+        LibClang.import_cindex()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
+__all__ = ["TypeInfo", "RenderableType", "ConfigReader", "LibClang", "Variable", "Function", "Declarations", "Profile", "Cache",
+           "Prelude", "Combined", "SymbolIndex", "CompileDb", "Stamp", "History", "Depfile", "MockupWriter", "Hammock",
+           "ElfReader", "NmWrapper", "Server", "Watcher", "watch", "serve", "create_index", "argument_parser", "run",
+           "target_arguments", "run_manifest", "generate", "outputs", "dependencies", "report", "main"] + LibClang.names
 
 if __name__ == "__main__":
-    main(sys.argv)
+    main(sys.argv[1:])
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import shutil
+
+import pytest
+
+from benchmarks.project import SyntheticProject, ProjectSize
+from benchmarks.__main__ import main
+from benchmarks.suite import Benchmark, compare
+from hammocking.hammocking import ConfigReader, NmWrapper
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="Needs a C compiler")
+def test_synthetic_project(tmp_path):
+    ConfigReader()
+    project = SyntheticProject(tmp_path, ProjectSize(headers=4, declarations=16, depth=2, undefined=20, sources=2)).generate()
+    assert len(project.sources) == 2 and len(project.symbols) == 20
+    project.build()
+    assert set(project.symbols) <= NmWrapper(project.plink).get_undefined_symbols()
+    hammock = Benchmark(project).read()
+    assert len(hammock.writer.functions) + len(hammock.writer.variables) == 20
+
+
+def test_compare(capsys):
+    baseline = {"sizes": {"small": {"stages": {"read": {"median": 1.0}, "render": {"median": 1.0}}}}}
+    results = {"sizes": {"small": {"stages": {"read": {"median": 1.5}, "render": {"median": 1.05}, "nm": {"median": 0.1}}}}}
+    regressions = compare(baseline, results, threshold=0.1)
+    assert len(regressions) == 1 and "read" in regressions[0]
+    assert "+50.0%" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("argument", ["--depth=0", "--sources=0", "--headers=-1"])
+def test_invalid_size(tmp_path, capsys, argument):
+    with pytest.raises(SystemExit):
+        main(["generate", str(tmp_path), argument])
+    assert "must be at least" in capsys.readouterr().err
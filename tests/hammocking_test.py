@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import logging
 import unittest
+import threading
+import time
+import shutil
+import socket
+import json
+import stat
+import subprocess
+import weakref
+from unittest.mock import patch
+from pathlib import Path
+from typing import List
 
 import pytest
 
 from hammocking.hammocking import *
+from hammocking.client import request, default_socket_path as client_socket_path
 
 # Apply default config
 ConfigReader()
@@ -20,6 +35,16 @@ def clang_parse(snippet: str):
         return c.kind == CursorKind.VAR_DECL or c.kind == CursorKind.FUNCTION_DECL
     return next(filter (is_var_or_func, Hammock.iter_children(translation_unit.cursor)))
 
+
+@pytest.fixture
+def parsed_sources(monkeypatch) -> List[str]:
+    """The names of the sources extracted by Hammock, in order"""
+    parsed = []
+    extract = Hammock.extract
+    monkeypatch.setattr(Hammock, "extract", lambda self, input, symbols=None: parsed.append(input.name) or extract(self, input, symbols))
+    return parsed
+
+
 class TestVariable:
     def test_simple(self):
         "Basic type"
@@ -103,6 +128,18 @@ class TestVariable:
         assert w.get_definition() == "int *const y"
         assert w.initializer() == "(int *const)0"
 
+    def test_type_info_shared(self):
+        "Types of the same spelling and canonical type are analyzed once"
+        RenderableType.infos = {}
+        point = "typedef struct { int x; } point_t; typedef int length_t;"
+        a = Function(clang_parse(point + "point_t a(point_t p, length_t l);"))
+        b = Variable(clang_parse(point + "extern point_t b;"))
+        assert b.initializer() == a.default_return() == "(point_t){0}"
+        assert a.params[1].initializer() == "(length_t)0"
+        assert len(RenderableType.infos) == 2  # point_t and length_t, not int
+        assert Variable(clang_parse("int c;")).initializer() == "(int)0"
+        assert len(RenderableType.infos) == 3
+
 
 class TestFunction:
     def test_void_void(self):
@@ -186,6 +223,16 @@ class TestFunction:
         assert f.get_call() == "x(cb)"
         assert f.get_param_types() == "int (*)(void)"
 
+    def test_storage_of_params(self):
+        "Assignable variables for the parameters"
+        f = Function(clang_parse("void x(const int a, char b[8], int c[3][4], char *const d, const char *e, int (*f)(int));"))
+        assert [param.get_storage_definition() for param in f.params] == [
+            "int a", "char *b", "int (*c)[4]", "char *d", "const char * e", "int (*f)(int)"]
+        assert Function(clang_parse("int (*x(void))(int);")).get_return_definition("values[2]") == "int (*values[2])(int)"
+        f = Function(clang_parse("typedef int arr_t[4]; typedef const arr_t carr_t; void x(arr_t a, carr_t b);"))
+        assert [param.get_storage_definition() for param in f.params] == ["int *a", "const int *b"]
+        assert Function(clang_parse("const int x(void);")).get_return_definition("values[2]") == "int values[2]"
+
     def test_blank_func(self):
         "Blank (nonproto) function"
         f = Function(clang_parse("void x();"))
@@ -419,6 +466,74 @@ extern "C" {
         writer.set_mockup_style('plain_c')
         assert writer.default_language_mode() == 'c'
 
+    def test_shards(self, tmp_path):
+        writer, by_header = MockupWriter(shards=2), MockupWriter(shards="header")
+        for name, header in [("a", "x.h"), ("b", "y.h"), ("c", "x.h")]:
+            writer.add_function(clang_parse(f"int {name}(void);"), header)
+            by_header.add_function(clang_parse(f"int {name}(void);"), header)
+        assert [path.name for path in writer.outputs(tmp_path)] == [
+            "mockup.cc", "mockup.h", "mockup_part0.cc", "mockup_part1.cc", "mockup_part0.h", "mockup_part1.h"]
+        writer.write(tmp_path)
+        assert "a()" not in (tmp_path / "mockup.cc").read_text()
+        assert "mockup_part0_ptr = &name; mockup_part1_ptr = &name;" in (tmp_path / "mockup.h").read_text()
+        assert "a()" in (tmp_path / "mockup_part0.cc").read_text() and "b()" in (tmp_path / "mockup_part0.cc").read_text()
+        assert "c()" in (tmp_path / "mockup_part1.cc").read_text()
+        assert "a()" in by_header.render(Path("parts/mockup.cc.j2"), 0) and "c()" in by_header.render(Path("parts/mockup.cc.j2"), 0)
+        assert "b()" in by_header.render(Path("parts/mockup.cc.j2"), 1)
+
+    def test_custom_templates(self, tmp_path, monkeypatch):
+        (tmp_path / "styles" / "mine").mkdir(parents=True)
+        (tmp_path / "styles" / "mine" / "fake.cpp.j2").write_text("{% for f in functions %}{{f.name}}\n{% endfor %}")
+        monkeypatch.setattr(MockupWriter, "environments", {})
+        MockupWriter.set_bytecode_cache_dir(tmp_path / "jinja")
+        try:
+            writer = MockupWriter(str(tmp_path / "styles" / "mine"))
+            assert writer.default_language_mode() == 'c++'
+            writer.add_function(clang_parse("void x(void);"))
+            writer.write(tmp_path)
+            assert (tmp_path / "fake.cpp").read_text() == "x\n"
+            assert MockupWriter(str(tmp_path / "styles" / "mine")).environment is writer.environment
+            assert list((tmp_path / "jinja").iterdir()), "Compiled template shall be cached"
+        finally:
+            MockupWriter.set_bytecode_cache_dir(None)
+
+
+    @pytest.mark.skipif(shutil.which("cc") is None, reason="Needs a C compiler")
+    def test_fake_c(self, tmp_path):
+        (tmp_path / "api.h").write_text("typedef struct { int a; } point_t;\ntypedef int arr_t[4];\n"
+                                         "int add(int a, const int b);\nvoid fill(unsigned char buffer[8]);\npoint_t where(void);\n"
+                                         "void takes(arr_t a);\nconst int cget(void);\n")
+        (tmp_path / "prod.c").write_text('#include "api.h"\n')
+        (tmp_path / "test.c").write_text("""#include <assert.h>
+#include "mockup.h"
+int main(void) {
+    int i;
+    unsigned char buffer[8];
+    assert(MOCKUP_HISTORY == 3);
+    mockup_fakes.add.returns[0] = 5;
+    mockup_fakes.add.returns[1] = 7;
+    mockup_fakes.add.returns_count = 2;
+    for (i = 0; i < 5; i++)
+        assert(add(i, 10 * i) == (i == 0 ? 5 : 7));
+    assert(mockup_fakes.add.call_count == 5 && mockup_fakes.add.calls[4 % 3].b == 40 && mockup_fakes.add.calls[2].a == 2);
+    fill(buffer);
+    assert(mockup_fakes.fill.calls[0].buffer == buffer && where().a == 0);
+    arr_t array;
+    takes(array);
+    assert(mockup_fakes.takes.calls[0].a == array);
+    mockup_fakes.cget.returns[0] = 3;
+    mockup_fakes.cget.returns_count = 1;
+    assert(cget() == 3);
+    mockup_reset();
+    assert(mockup_fakes.add.call_count == 0 && mockup_fakes.fill.call_count == 0 && add(1, 2) == 0);
+    return 0;
+}
+""")
+        assert run(["--symbols", "add", "fill", "where", "takes", "cget", "--sources", str(tmp_path / "prod.c"), "--outdir", str(tmp_path),
+                    "--style", "fake_c", "--fake-history", "3"]) == 0
+        subprocess.run(["cc", "-std=c99", "-Wall", "-Werror", "-o", "test", "test.c", "mockup.c"], cwd=tmp_path, check=True)
+        subprocess.run([str(tmp_path / "test")], check=True)
+
 
 class TestNmWrapper(unittest.TestCase):
 
@@ -435,6 +550,42 @@ class TestNmWrapper(unittest.TestCase):
         assert not NmWrapper.mock_it('  U _abc')  # Every underline function is now excluded
         assert '_xyz' == NmWrapper.mock_it('  U _xyz') # ... except _xyz
 
+@pytest.mark.skipif(not shutil.which("cc") or not shutil.which("ar") or sys.platform != "linux",
+                    reason="Requires a compiler and ar for ELF objects")
+class TestElfReader:
+    @pytest.fixture
+    def objects(self, tmp_path) -> List[Path]:
+        (tmp_path / "first.c").write_text("""extern int a; extern void f(int); __attribute__((weak)) extern void w(void);
+            static int s(void) { return 0; }
+            int first(void) { f(a); if (w) w(); return s(); }""")
+        (tmp_path / "second.c").write_text("extern int b; void __gcov_exit(void); void second(void) { __gcov_exit(); b = first(); }")
+        subprocess.run(["cc", "-c", "first.c", "second.c"], cwd=tmp_path, check=True)
+        subprocess.run(["ar", "rcs", "lib.a", "first.o", "second.o"], cwd=tmp_path, check=True)
+        return [tmp_path / "first.o", tmp_path / "lib.a"]
+
+    def test_undefined_symbols(self, objects):
+        assert {"a", "f"} <= set(ElfReader.undefined_symbols(objects[0]))
+        assert "w" not in ElfReader.undefined_symbols(objects[0])  # weak, shown as "w" by nm
+        assert {"a", "f", "b", "first", "__gcov_exit"} <= set(ElfReader.undefined_symbols(objects[1]))
+
+    def test_same_as_nm(self, objects, monkeypatch):
+        for plink in objects:
+            assert ElfReader.supports(plink)
+            monkeypatch.setattr(NmWrapper, "backend", "nm")
+            with_nm = NmWrapper(plink).get_undefined_symbols()
+            monkeypatch.setattr(NmWrapper, "backend", "native")
+            assert NmWrapper(plink).get_undefined_symbols() == with_nm
+            assert "__gcov_exit" not in with_nm
+
+    def test_many_objects(self, objects, tmp_path, monkeypatch):
+        cache = Cache(tmp_path / "cache")
+        symbols = NmWrapper(objects, cache).undefined_symbols
+        assert len(symbols) == len(set(symbols))
+        assert set(symbols) == NmWrapper(objects[1]).get_undefined_symbols() | NmWrapper(objects[0]).get_undefined_symbols()
+        monkeypatch.setattr(NmWrapper, "read_symbols", None)  # Shall not be called for cached objects
+        assert NmWrapper(objects, cache).undefined_symbols == symbols
+
+
 class TestHammock(unittest.TestCase):
     def test_variable(self):
         """Mock a variable"""
@@ -541,6 +692,29 @@ extern void ignore_me();
         assert len(mock.writer.functions) == 1, "Mockup shall have a function"
         assert mock.writer.functions[0].get_signature() == "void foo()", "Function shall be created in the mockup"
 
+    def test_translation_unit_released(self):
+        """The declarations do not keep the translation unit alive"""
+        mock = Hammock(["a", "f"])
+        units = []
+        create = Hammock.create_translation_unit
+        with patch.object(Hammock, "create_translation_unit",
+                          staticmethod(lambda parseOpts, index=None: units.append(create(parseOpts, index)) or units[-1])):
+            declarations = mock.extract("extern int a; int f(int);")
+        unit = weakref.ref(units.pop())
+        self.assertIsNone(unit(), "Translation unit shall be disposed after the traversal")
+        self.assertEqual(Function.from_record(declarations.symbols["f"]["record"]).get_signature(), "int f(int unnamed1)")
+
+    def test_return_type(self):
+        """Templates can use the return type like before the declarations were recorded"""
+        mock = Hammock(["s"])
+        declarations = mock.extract("struct point { int x; }; const struct point s(void);")
+        for function in [Function(clang_parse("struct point { int x; }; const struct point s(void);")),
+                         Function.from_record(declarations.symbols["s"]["record"])]:
+            self.assertEqual(function.type.spelling, "const struct point")
+            self.assertEqual(function.type.render("s()"), "const struct point s()")
+            self.assertEqual(function.type.initializer(), "(const struct point){0}")
+            self.assertTrue(function.type.is_struct and function.type.is_constant and not function.type.is_array)
+
     def test_extern_c_variable(self):
         """Mock a variable that is inside an "extern C" section"""
         mock = Hammock(["foo"])
@@ -588,5 +762,667 @@ extern void foo();
             mock.writer.functions[0].get_signature(), "int printf(const char * format, ...)", "Function shall be created in the mockup"
         )
 
+
+class TestCache:
+    def mock(self, cache: Cache, source: Path) -> Hammock:
+        mock = Hammock({"a_y1", "c_set_u2", "local_extern", "not_there"}, ["-Itests/data/mini_c_test/includes"],
+                       mockup_style="plain_c", cache=cache)
+        mock.read([source])
+        return mock
+
+    def test_warm_run_does_not_parse(self, tmp_path, monkeypatch):
+        cache = Cache(tmp_path / "cache")
+        cold = self.mock(cache, Path("tests/data/mini_c_test/b.c"))
+        monkeypatch.setattr(Hammock, "create_translation_unit", None)  # Any parse fails now
+        warm = self.mock(Cache(tmp_path / "cache"), Path("tests/data/mini_c_test/b.c"))
+        assert warm.symbols == cold.symbols == {"not_there"}
+        assert warm.writer.headers == cold.writer.headers
+        assert warm.writer.get_mockup("mockup.c") == cold.writer.get_mockup("mockup.c")
+
+    def test_header_change(self, tmp_path):
+        project = tmp_path / "project"
+        shutil.copytree("tests/data/mini_c_test", project)
+        source = project / "b.c"
+        cache = Cache(tmp_path / "cache")
+        self.mock(cache, source)
+        header = project / "c.h"
+        header.write_text(header.read_text().replace("void c_set_u2(int u2);", "void c_set_u2(long u2);"))
+        mock = self.mock(cache, source)
+        assert mock.writer.functions[0].get_signature() == "void c_set_u2(long u2)"
+
+    def test_other_versions(self, tmp_path, monkeypatch):
+        self.mock(Cache(tmp_path / "cache"), Path("tests/data/mini_c_test/b.c"))
+        monkeypatch.setattr(LibClang, "version", "other")
+        parsed = []
+        create_translation_unit = Hammock.create_translation_unit
+        monkeypatch.setattr(Hammock, "create_translation_unit",
+                            classmethod(lambda cls, *args, **kwargs: parsed.append(args) or create_translation_unit(*args, **kwargs)))
+        self.mock(Cache(tmp_path / "cache"), Path("tests/data/mini_c_test/b.c"))
+        assert parsed
+
+    def test_eviction(self, tmp_path):
+        cache = Cache(tmp_path, max_size=100)
+        cache.put("0123", {"data": "x" * 80})
+        os.utime(cache.path("0123"), (0, 0))
+        cache.put("4567", {"data": "y" * 80})
+        cache.evict()
+        assert cache.get("0123") is None
+        assert cache.get("4567") == {"data": "y" * 80}
+
+    def test_normalize_arguments(self):
+        assert Hammock.normalize_arguments(["-I", "inc", "-DX", "-x", "c"]) == ["-Iinc", "-DX", "-xc"]
+
+
+class TestParallel:
+    @pytest.fixture
+    def sources(self, tmp_path) -> List[Path]:
+        """Four sources, the symbols are declared in several of them with different types"""
+        for index, declarations in enumerate(["int f(void);", "long f(void); int g;", "char g; int h(int x);", "int h(int y);"]):
+            (tmp_path / f"s{index}.h").write_text(declarations)
+            (tmp_path / f"s{index}.c").write_text(f'#include "s{index}.h"\n')
+        return [tmp_path / f"s{index}.c" for index in range(4)]
+
+    def test_same_declarations_as_sequential(self, sources):
+        sequential = Hammock({"f", "g", "h"}, mockup_style="plain_c")
+        sequential.read(sources)
+        parallel = Hammock({"f", "g", "h"}, mockup_style="plain_c")
+        parallel.read(sources, jobs=3)
+        assert parallel.done
+        assert parallel.writer.headers == sequential.writer.headers
+        assert parallel.writer.get_mockup("mockup.c") == sequential.writer.get_mockup("mockup.c")
+        assert "int f()" in parallel.writer.get_mockup("mockup.c")
+        assert "int h(int x)" in parallel.writer.get_mockup("mockup.c")
+
+    def test_unresolved(self, sources):
+        mock = Hammock({"f", "not_there"}, mockup_style="plain_c")
+        mock.read(sources, jobs=2)
+        assert mock.symbols == {"not_there"}
+
+    def test_cache_evicted(self, sources, tmp_path, monkeypatch):
+        evicted = []
+        monkeypatch.setattr(Cache, "evict", lambda self: evicted.append(self))
+        mock = Hammock({"f", "g", "h"}, mockup_style="plain_c", cache=Cache(tmp_path / "cache"))
+        mock.read(sources, jobs=2)
+        mock.write(tmp_path)
+        assert evicted == [mock.cache]
+
+
+class TestTopLevel:
+    def test_top_level_only(self):
+        mock = Hammock({"f", "g", "h", "x"}, ["-xc++"])
+        mock.parse('extern "C" { int f(void); } namespace n { int g(void); } struct s { int h(void); }; void x(void);')
+        assert sorted(function.name for function in mock.writer.functions) == ["f", "x"]
+        assert mock.symbols == {"g", "h"}
+
+
+class TestPrelude:
+    def test_leading_includes(self, tmp_path):
+        source = tmp_path / "x.c"
+        source.write_text("""/* License
+   text */
+#include "a.h"  // first
+
+#  include <b.h>
+int x;
+#include "c.h"
+""")
+        assert Prelude.leading_includes(source) == ['#include "a.h"', '#  include <b.h>']
+
+    def test_detect(self, tmp_path):
+        (tmp_path / "x.c").write_text('#include "a.h"\n#include "b.h"\n#include "c.h"\n')
+        (tmp_path / "y.c").write_text('#include "a.h"\n#include "b.h"\n#include "d.h"\n')
+        preludes = Prelude.detect([tmp_path / "x.c", tmp_path / "y.c"])
+        assert len(preludes) == 1
+        assert preludes[0].content == '#include "a.h"\n#include "b.h"\n'
+
+    def test_same_declarations(self, tmp_path):
+        source = Path("tests/data/mini_c_test/b.c")
+        symbols = {"a_y1", "c_set_u2", "local_extern", "b_init"}
+        direct = Hammock(set(symbols), ["-Itests/data/mini_c_test/includes"], mockup_style="plain_c")
+        direct.read([source])
+        precompiled = Hammock(set(symbols), ["-Itests/data/mini_c_test/includes"], mockup_style="plain_c",
+                              cache=Cache(tmp_path))
+        precompiled.prepare_preludes([source])
+        assert precompiled.preludes[0].pch.exists()
+        precompiled.read([source])
+        assert precompiled.done
+        assert precompiled.writer.headers == direct.writer.headers
+        assert precompiled.writer.get_mockup("mockup.c") == direct.writer.get_mockup("mockup.c")
+
+
+class TestSymbolIndex:
+    def test_incremental_update(self, tmp_path):
+        first, second = tmp_path / "first.h", tmp_path / "second.h"
+        first.write_text("int f(void);\nextern int v;\n")
+        second.write_text("long f(void);\nvoid g(int x);\n")
+        hammock = Hammock(set(), mockup_style="plain_c")
+        index = SymbolIndex(tmp_path / "project.idx")
+        index.update([first, second], hammock)
+        index.save()
+
+        second.write_text("long f(void);\nvoid g(int y);\n")
+        parsed = []
+        extract = hammock.extract
+        hammock.extract = lambda header: parsed.append(header) or extract(header)
+        index = SymbolIndex(tmp_path / "project.idx")
+        index.update([first, second], hammock)
+        assert parsed == [second]
+
+        mock = Hammock({"f", "g", "v", "not_there"}, mockup_style="plain_c")
+        mock.add_declarations(index.declarations())
+        assert mock.symbols == {"not_there"}
+        assert mock.writer.headers == [first.as_posix(), second.as_posix()]
+        assert [f.get_signature() for f in mock.writer.functions] == ["int f()", "void g(int y)"]
+
+    def test_other_directory_and_arguments(self, tmp_path, monkeypatch):
+        (tmp_path / "proj" / "inc").mkdir(parents=True)
+        (tmp_path / "build").mkdir()
+        (tmp_path / "proj" / "inc" / "a.h").write_text("#ifdef WIDE\nlong f(void);\n#else\nint f(void);\n#endif\n")
+        (tmp_path / "proj" / "b.c").write_text('#include "inc/a.h"\n')
+        monkeypatch.chdir(tmp_path / "proj")
+        assert create_index(["--index", str(tmp_path / "project.idx"), "--headers", "inc/a.h", "--style", "plain_c", "-DWIDE"]) == 0
+        monkeypatch.chdir(tmp_path / "build")
+        argv = ["--symbols", "f", "--sources", "../proj/b.c", "--outdir", ".", "--style", "plain_c", "--index", str(tmp_path / "project.idx")]
+        assert run(argv + ["-DWIDE"]) == 0
+        header = (tmp_path / "proj" / "inc" / "a.h").as_posix()
+        assert f'#include "{header}"' in Path("mockup.h").read_text() and "long f()" in Path("mockup.c").read_text()
+        assert run(argv) == 0  # Other arguments, the index is not used
+        assert "int f()" in Path("mockup.c").read_text()
+
+
+class TestManifest:
+    def test_targets_share_declarations(self, tmp_path, parsed_sources, capsys):
+        (tmp_path / "gmock").mkdir()
+        (tmp_path / "plain_c").mkdir()
+        (tmp_path / "failing").mkdir()
+        source = "tests/data/mini_c_test/b.c"
+        manifest = tmp_path / "targets.json"
+        manifest.write_text(json.dumps([
+            {"symbols": ["a_y1", "c_set_u2"], "sources": [source], "outdir": str(tmp_path / "gmock"),
+             "args": ["-xc"]},
+            {"symbols": ["a_y1", "local_extern"], "sources": [source], "outdir": str(tmp_path / "plain_c"),
+             "style": "plain_c", "suffix": "_stub"},
+            {"name": "failing", "symbols": ["not_there"], "sources": [source], "outdir": str(tmp_path / "failing"),
+             "style": "plain_c"},
+        ]))
+        assert run(["--manifest", str(manifest), "-Itests/data/mini_c_test/includes"]) == 1
+        assert len(parsed_sources) == 1  # The gmock target is parsed as C, too
+        assert "c_set_u2" in (tmp_path / "gmock" / "mockup.cc").read_text()
+        assert "local_extern" in (tmp_path / "plain_c" / "mockup_stub.c").read_text()
+        err = capsys.readouterr().err
+        assert "The following symbols could not be mocked:\nnot_there\n" in err
+        assert "HammocKing failed for failing\n" in err
+        assert Hammock.memo is None
+
+    def test_invalid_targets(self, tmp_path, capsys, caplog):
+        manifest = tmp_path / "targets.json"
+        manifest.write_text(json.dumps([
+            {"name": "no outdir", "symbols": ["a_y1"], "sources": ["tests/data/mini_c_test/b.c"]},
+            {"outdir": str(tmp_path / "no symbols"), "sources": ["tests/data/mini_c_test/b.c"]},
+            "not a target",
+            {"symbols": ["a_y1"], "sources": ["tests/data/mini_c_test/b.c"], "outdir": str(tmp_path)},
+        ]))
+        assert run(["--manifest", str(manifest), "-Itests/data/mini_c_test/includes"]) == 1
+        assert "a_y1" in (tmp_path / "mockup.cc").read_text()
+        assert "no outdir: invalid target in" in caplog.text and "the key 'outdir' is missing" in caplog.text
+        assert 'one of the keys "symbols" or "plink" is required' in caplog.text
+        assert "HammocKing failed for target 3\n" in capsys.readouterr().err
+
+
+class TestCompileDb:
+    def test_filter(self, tmp_path):
+        arguments = ["-O2", "-Wall", "-Wp,-DW", "-g3", "-Iinc", "-I", "..", "-isystem", "sys", "-DX=1", "-MD", "-MF", "a.d",
+                     "-o", "a.o", "-c", "a.c"]
+        assert CompileDb.filter(arguments, tmp_path, tmp_path / "a.c") == [
+            "-Wp,-DW", f"-I{tmp_path / 'inc'}", f"-I{tmp_path / '..'}", "-isystem", str(tmp_path / "sys"), "-DX=1"]
+        assert CompileDb.filter(["-include-pch", "pre.pch", "-include", "a.h", "-includeb.h", "-imacros", "m.h"], tmp_path) == [
+            "-include-pch", str(tmp_path / "pre.pch"), "-include", str(tmp_path / "a.h"), "-include", str(tmp_path / "b.h"),
+            "-imacros", str(tmp_path / "m.h")]
+
+    def test_other_file_name(self, tmp_path, capsys):
+        (tmp_path / "commands.json").write_text("[]")
+        with pytest.raises(ValueError):
+            CompileDb(tmp_path / "commands.json")
+        with pytest.raises(SystemExit):
+            run(["--symbols", "a_y1", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(tmp_path),
+                 "--compile-db", str(tmp_path / "commands.json")])
+        assert "compile_commands.json" in capsys.readouterr().err
+
+    def test_sources_with_own_arguments(self, tmp_path):
+        project = Path("tests/data/mini_c_test").absolute()
+        (tmp_path / "other.c").write_text("#include <a.h>\n#include <c.h>\n")
+        (tmp_path / "compile_commands.json").write_text(json.dumps([
+            {"directory": str(project), "command": "cc -O2 -Iincludes -c b.c -o b.o", "file": "b.c"},
+            {"directory": str(tmp_path), "command": f"cc -O0 -g -I{project}/includes -c other.c -o other.o", "file": "other.c"},
+        ]))
+        groups = CompileDb(tmp_path).group([project / "b.c", tmp_path / "other.c"])
+        assert groups == {(f"-I{project / 'includes'}",): [project / "b.c", tmp_path / "other.c"]}
+        outdir = tmp_path / "out"
+        outdir.mkdir()
+        assert run(["--symbols", "a_y1", "c_set_u2", "--sources", str(project / "b.c"), "--outdir", str(outdir),
+                    "--compile-db", str(tmp_path / "compile_commands.json")]) == 0
+        assert "c_set_u2" in (outdir / "mockup.h").read_text()
+
+
+class TestProfile:
+    def test_trace_events(self, tmp_path):
+        profile, stats = tmp_path / "profile.json", tmp_path / "profile.prof"
+        assert run(["--symbols", "a_y1", "c_set_u2", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(tmp_path),
+                    "--profile", str(profile), "--cprofile", str(stats), "-Itests/data/mini_c_test/includes"]) == 0
+        events = {event["name"]: event for event in json.loads(profile.read_text())["traceEvents"]}
+        assert {"parse", "traverse", "source", "render", "run"} <= set(events)
+        assert events["source"]["args"]["resolved"] == 2
+        assert events["traverse"]["args"]["cursors"] > 2
+        assert all(key in events["parse"] for key in ["ts", "dur", "pid", "tid"])
+        assert "cpu_ms" in events["parse"]["args"] and "max_rss_growth_kb" in events["parse"]["args"]
+        assert stats.stat().st_size > 0
+        assert Profile.active is None
+
+    def test_worker_events(self, tmp_path):
+        for index in range(3):
+            (tmp_path / f"s{index}.c").write_text(f"int f{index}(void);\n")
+        profile = tmp_path / "profile.json"
+        assert run(["--symbols", "f0", "f1", "f2", "--sources", *[str(tmp_path / f"s{index}.c") for index in range(3)],
+                    "--outdir", str(tmp_path), "--profile", str(profile), "--jobs", "2"]) == 0
+        events = json.loads(profile.read_text())["traceEvents"]
+        sources = [event for event in events if event["name"] == "source"]
+        assert sorted(Path(event["args"]["source"]).name for event in sources) == ["s0.c", "s1.c", "s2.c"]
+        assert all(event["pid"] != os.getpid() for event in sources)
+        assert {event["pid"] for event in events if event["name"] == "process_name"} >= {event["pid"] for event in sources}
+
+
+class TestStamp:
+    def test_write_if_different(self, tmp_path):
+        path = tmp_path / "mockup.h"
+        assert MockupWriter.write_if_different(path, "content\n")
+        os.utime(path, (0, 0))
+        assert not MockupWriter.write_if_different(path, "content\n")
+        assert path.stat().st_mtime == 0
+        assert MockupWriter.write_if_different(path, "other content\n")
+        assert path.read_text() == "other content\n"
+        assert not MockupWriter.write_if_different(path, iter(["other ", "content\n"]))
+        assert list(tmp_path.iterdir()) == [path]
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="POSIX permissions")
+    def test_permissions(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Cache, "umask", None)
+        umask = os.umask(0o022)
+        try:
+            assert MockupWriter.write_if_different(tmp_path / "mockup.h", "content\n")
+            assert stat.S_IMODE((tmp_path / "mockup.h").stat().st_mode) == 0o644
+            os.chmod(tmp_path / "mockup.h", 0o664)
+            assert MockupWriter.write_if_different(tmp_path / "mockup.h", "other content\n")
+            assert stat.S_IMODE((tmp_path / "mockup.h").stat().st_mode) == 0o664
+            cache = Cache(tmp_path / "cache")
+            cache.put("0123", {})
+            assert stat.S_IMODE(cache.path("0123").stat().st_mode) == 0o644
+        finally:
+            os.umask(umask)
+
+    def test_streamed_mockup(self, tmp_path):
+        writer = MockupWriter()
+        writer.add_header("a.h")
+        for name in ["b", "a"]:
+            writer.add_function(clang_parse(f"int {name}(int x);"))
+        writer.write(tmp_path)
+        assert (tmp_path / "mockup.cc").read_text() == writer.get_mockup("mockup.cc")
+        writer.add_function(clang_parse("void c(void);"))
+        assert "c()" in writer.get_mockup("mockup.cc")
+
+    def test_skip_if_unchanged(self, tmp_path, monkeypatch, capsys):
+        project = tmp_path / "project"
+        shutil.copytree("tests/data/mini_c_test", project)
+        outdir = tmp_path / "out"
+        outdir.mkdir()
+        argv = ["--symbols", "c_set_u2", "not_there", "--sources", str(project / "b.c"), "--outdir", str(outdir),
+                "--style", "plain_c", "--stamp", str(outdir / "mockup.stamp"), f"-I{project / 'includes'}"]
+        assert run(argv) == 1
+        read = Hammock.read
+        monkeypatch.setattr(Hammock, "read", None)  # Any parse fails now
+        capsys.readouterr()
+        assert run(argv) == 1
+        assert capsys.readouterr().err.endswith("The following symbols could not be mocked:\nnot_there\n")
+
+        header = project / "c.h"
+        header.write_text(header.read_text().replace("void c_set_u2(int u2);", "void c_set_u2(long u2);"))
+        monkeypatch.setattr(Hammock, "read", read)
+        assert run(argv) == 1
+        assert "void c_set_u2(long u2)" in (outdir / "mockup.c").read_text()
+
+    def test_deleted_part(self, tmp_path, capsys):
+        argv = ["--symbols", "c_set_u2", "a_init", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(tmp_path),
+                "--style", "plain_c", "--shard-by", "header", "--stamp", str(tmp_path / "mockup.stamp"),
+                "-Itests/data/mini_c_test/includes"]
+        assert run(argv) == 0
+        part = tmp_path / "mockup_part1.c"
+        assert part.exists()
+        part.unlink()
+        capsys.readouterr()
+        assert run(argv) == 0
+        assert part.exists()
+        assert "up to date" not in capsys.readouterr().err
+        with pytest.raises(SystemExit):
+            run(["--symbols", "c_set_u2", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(tmp_path), "--shards", "0"])
+        assert "--shards: must be at least 1" in capsys.readouterr().err
+
+    def test_up_to_date_run_imports_neither_clang_nor_jinja(self, tmp_path):
+        argv = ["--symbols", "c_set_u2", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(tmp_path),
+                "--stamp", str(tmp_path / "mockup.stamp"), "-Itests/data/mini_c_test/includes"]
+        assert run(argv) == 0
+        script = ("import sys; from hammocking.hammocking import run; exit_code = run(sys.argv[1:]); "
+                  "print(exit_code, 'clang.cindex' in sys.modules, 'jinja2' in sys.modules)")
+        output = subprocess.run([sys.executable, "-c", script, *argv], capture_output=True, text=True, check=True).stdout
+        assert output.split() == ["0", "False", "False"]
+
+
+class TestLibClang:
+    def test_probe(self, tmp_path, monkeypatch):
+        library = tmp_path / "libclang.so"
+        library.write_bytes(b"")
+        monkeypatch.setattr(LibClang, "probe_file", tmp_path / "cache" / "libclang.json")
+        monkeypatch.setattr(LibClang, "library_file", "libclang.so")
+        monkeypatch.setattr(LibClang, "library", str(library))
+        monkeypatch.setattr(LibClang, "version", "clang version 1.0")
+        assert LibClang.read_probe() is None
+        LibClang.write_probe()
+        assert LibClang.read_probe()["library"] == str(library)
+        assert LibClang.read_probe()["version"] == "clang version 1.0"
+        monkeypatch.setattr(LibClang, "library_path", "/opt/llvm/lib")
+        assert LibClang.read_probe() is None  # Other settings
+        monkeypatch.setattr(LibClang, "library_path", None)
+        monkeypatch.setattr(sys.modules["clang.cindex"], "__file__", str(tmp_path / "other" / "cindex.py"))
+        assert LibClang.read_probe() is None  # Bindings of another environment
+        monkeypatch.undo()
+        monkeypatch.setattr(LibClang, "probe_file", tmp_path / "cache" / "libclang.json")
+        monkeypatch.setattr(LibClang, "library_file", "libclang.so")
+        assert LibClang.read_probe() is not None
+        os.utime(library, (0, 0))
+        assert LibClang.read_probe() is None  # Changed library
+
+    def test_explicit_import(self):
+        script = ("from clang.cindex import Index; from hammocking.hammocking import Function, Hammock, MockupWriter; "
+                  "tu = Index.create().parse('~.c', unsaved_files=[('~.c', 'int f(int a);')]); "
+                  "writer = MockupWriter('plain_c'); writer.add_function(next(Hammock.iter_children(tu.cursor))); "
+                  "print(writer.functions[0].get_signature())")
+        assert subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout == "int f(int a)\n"
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Located with dladdr")
+    def test_location(self):
+        LibClang.load()
+        location = LibClang.location(conf.lib)
+        assert Path(location).is_file() and "clang" in Path(location).name
+        assert "clang" in LibClang.read_version(conf.lib)
+
+
+class TestHistory:
+    def test_learned_order(self, tmp_path, parsed_sources):
+        (tmp_path / "h0.h").write_text("int f(int a);\n")
+        (tmp_path / "h1.h").write_text("int f(long a);\n")
+        (tmp_path / "h2.h").write_text("extern int x;\n")
+        sources = []
+        for name, headers in [("s0", ["h0.h"]), ("s1", ["h1.h"]), ("s2", ["h1.h", "h2.h"])]:
+            sources.append(tmp_path / f"{name}.c")
+            sources[-1].write_text("".join(f'#include "{header}"\n' for header in headers))
+        argv = ["--symbols", "f", "x", "--sources", *map(str, sources), "--outdir", str(tmp_path), "--style", "plain_c",
+                "--history", str(tmp_path / "history.json")]
+
+        assert run(argv) == 0
+        assert parsed_sources == ["s0.c", "s1.c", "s2.c"]
+        assert "int f(int a)" in (tmp_path / "mockup.c").read_text()
+
+        parsed_sources.clear()
+        assert run(argv) == 0
+        assert parsed_sources == ["s2.c", "s0.c"]  # s2 declares both symbols, but s0 declares f first
+        assert "int f(int a)" in (tmp_path / "mockup.c").read_text()
+
+        (tmp_path / "h0.h").write_text("int g(int a);\n")  # The history of s0 is stale now
+        parsed_sources.clear()
+        assert run(argv) == 0
+        assert parsed_sources == ["s2.c", "s0.c", "s1.c"]
+        assert "int f(long a)" in (tmp_path / "mockup.c").read_text()
+
+    def test_other_language_mode(self, tmp_path):
+        (tmp_path / "h0.h").write_text("#ifdef __cplusplus\nint f(int a);\n#endif\n")
+        (tmp_path / "h1.h").write_text("int f(long a);\n")
+        sources = []
+        for index in range(2):
+            sources.append(tmp_path / f"s{index}.c")
+            sources[-1].write_text(f'#include "h{index}.h"\n')
+        argv = ["--symbols", "f", "--sources", *map(str, sources), "--outdir", str(tmp_path), "--history", str(tmp_path / "history.json")]
+        assert run(argv + ["--style", "plain_c"]) == 0
+        assert "int f(long a)" in (tmp_path / "mockup.c").read_text()
+        assert run(argv + ["--style", "gmock"]) == 0  # s0 declares f in C++ only
+        assert "int f(int a)" in (tmp_path / "mockup.cc").read_text()
+
+
+class TestCombined:
+    def test_combined(self, tmp_path, parsed_sources):
+        (tmp_path / "h0.h").write_text("int f(int a);\n")
+        (tmp_path / "h1.h").write_text('#include "h0.h"\nint g(void);\n')
+        (tmp_path / "s0.c").write_text('#include "h0.h"\n// #include "missing.h"\nextern int y;\n')
+        (tmp_path / "s1.c").write_text('#include "h1.h"\n#include "h0.h"\nint x;\n#pragma weak x\n')
+        assert Combined.detect([tmp_path / "s0.c", tmp_path / "s1.c"])[0].content == '#include "h0.h"\n#include "h1.h"\n'
+        argv = ["--symbols", "f", "g", "y", "--sources", str(tmp_path / "s0.c"), str(tmp_path / "s1.c"), "--style", "plain_c"]
+        for outdir in ["separate", "combined"]:
+            (tmp_path / outdir).mkdir()
+        assert run(argv + ["--outdir", str(tmp_path / "separate")]) == 0
+        assert parsed_sources == ["s0.c", "s1.c"]
+
+        parsed_sources.clear()
+        assert run(argv + ["--outdir", str(tmp_path / "combined"), "--combine"]) == 0
+        assert parsed_sources == ["s0.c"]  # Only for y, which is declared in the source itself
+        for file in ["mockup.h", "mockup.c"]:
+            assert (tmp_path / "combined" / file).read_text() == (tmp_path / "separate" / file).read_text()
+
+        (tmp_path / "h1.h").write_text("int f(long a);\nint g(void);\n")  # Conflicts with h0.h
+        parsed_sources.clear()
+        assert run(argv + ["--outdir", str(tmp_path / "combined"), "--combine"]) == 0
+        assert parsed_sources == ["s0.c", "s1.c"]
+        assert "int f(int a)" in (tmp_path / "combined" / "mockup.c").read_text()
+
+
+    def test_not_combined(self, tmp_path, parsed_sources):
+        (tmp_path / "cfg.h").write_text("#ifdef WIDE_API\nlong get(void);\n#else\nint get(void);\n#endif\n")
+        (tmp_path / "s0.c").write_text('#define WIDE_API\n#include "cfg.h"\n')
+        (tmp_path / "s1.c").write_text('#include "cfg.h"\n')
+        (tmp_path / "s2.c").write_text('#include "cfg.h"\n')
+        (tmp_path / "s3.c").write_text('#include "cfg.h"\n#ifdef UNDEFINED\n#include "missing.h"\n#endif\n')
+        assert Combined.includes(tmp_path / "s0.c") is None and Combined.includes(tmp_path / "s3.c") is None
+        sources = [tmp_path / f"s{index}.c" for index in range(4)]
+        assert [combined.sources for combined in Combined.detect(sources)] == [sources[1:3]]
+        (tmp_path / "other").mkdir()
+        (tmp_path / "other" / "s.c").write_text('#include "../cfg.h"\n')
+        assert [combined.sources for combined in Combined.detect([sources[1], tmp_path / "other" / "s.c", sources[2]])] == []
+        assert run(["--symbols", "get", "--sources", *map(str, sources), "--style", "plain_c", "--outdir", str(tmp_path),
+                    "--combine"]) == 0
+        assert parsed_sources == ["s0.c"]
+        assert "long get()" in (tmp_path / "mockup.c").read_text()
+
+
+class TestStyles:
+    def test_parse_style(self, tmp_path):
+        assert MockupWriter.parse_style("gmock", None, tmp_path) == ("gmock", None, tmp_path)
+        assert MockupWriter.parse_style("plain_c:_stub", "_x", tmp_path) == ("plain_c", "_stub", tmp_path)
+        assert MockupWriter.parse_style("plain_c::C:/out", "_x", tmp_path) == ("plain_c", "_x", Path("C:/out"))
+        assert MockupWriter.parse_style(str(tmp_path), None, None) == (str(tmp_path), None, None)
+
+    def test_several_styles(self, tmp_path, parsed_sources):
+        for outdir in ["gmock", "plain_c", "both", "stubs"]:
+            (tmp_path / outdir).mkdir()
+        argv = ["--symbols", "c_set_u2", "a_y1", "--sources", "tests/data/mini_c_test/b.c", "-Itests/data/mini_c_test/includes"]
+        assert run(argv + ["--outdir", str(tmp_path / "gmock")]) == 0
+        assert run(argv + ["--outdir", str(tmp_path / "plain_c"), "--style", "plain_c", "--suffix", "_stub", "-xc++"]) == 0
+        parsed_sources.clear()
+        assert run(argv + ["--outdir", str(tmp_path / "both"), "--style", "gmock", f"plain_c:_stub:{tmp_path / 'stubs'}"]) == 0
+        assert parsed_sources == ["b.c"]
+        for file in ["mockup.h", "mockup.cc"]:
+            assert (tmp_path / "both" / file).read_text() == (tmp_path / "gmock" / file).read_text()
+        for file in ["mockup_stub.h", "mockup_stub.c"]:
+            assert (tmp_path / "stubs" / file).read_text() == (tmp_path / "plain_c" / file).read_text()
+
+
+class TestDepfile:
+    def test_dependencies(self, tmp_path):
+        outdir, depfile = tmp_path / "out", tmp_path / "mockup.d"
+        outdir.mkdir()
+        argv = ["--symbols", "c_set_u2", "a_y1", "--sources", "tests/data/mini_c_test/b.c", "--outdir", str(outdir),
+                "--style", "plain_c", "--stamp", str(tmp_path / "mockup.stamp"), "--depfile", str(depfile),
+                "-Itests/data/mini_c_test/includes"]
+        assert run(argv) == 0
+        rule = depfile.read_text()
+        targets, dependencies = rule.split(": \\\n")
+        assert targets == f"{outdir.as_posix()}/mockup.c {outdir.as_posix()}/mockup.h"
+        dependencies = [line.strip(" \\") for line in dependencies.splitlines()]
+        for file in ["tests/data/mini_c_test/b.c", "tests/data/mini_c_test/c.h", "tests/data/mini_c_test/includes/a.h",
+                     "hammocking/templates/plain_c/mockup.c.j2", "hammocking/hammocking.ini"]:
+            assert Path(file).absolute().as_posix() in dependencies
+
+        depfile.unlink()
+        assert run(argv + ["--depfile-target", str(tmp_path / "mockup.done")]) == 0  # Up to date
+        assert depfile.read_text() == rule.replace(targets, f"{tmp_path.as_posix()}/mockup.done")
+
+    def test_escape(self):
+        assert Depfile.escape("/a dir/$x#1.h") == "/a\\ dir/$$x\\#1.h"
+
+
+class TestWatcher:
+    @pytest.mark.parametrize("backend", ["poll", pytest.param("inotify", marks=pytest.mark.skipif(
+        sys.platform != "linux", reason="inotify is only available on Linux"))])
+    def test_regenerate_on_change(self, tmp_path, monkeypatch, backend):
+        project = tmp_path / "project"
+        shutil.copytree("tests/data/mini_c_test", project)
+        outdir = tmp_path / "out"
+        outdir.mkdir()
+        for name, value in [("translation_units", {}), ("memo", {})]:
+            monkeypatch.setattr(Hammock, name, value)
+        monkeypatch.setattr(MockupWriter, "rendered", {})
+        watcher = Watcher(["--symbols", "c_set_u2", "a_y1", "--sources", str(project / "b.c"), "--outdir", str(outdir),
+                           "--style", "plain_c", f"-I{project / 'includes'}"], backend, interval=0.02)
+        assert watcher.run_once() == 0
+        header = project / "c.h"
+        assert str(header) in watcher.files and str(project / "includes" / "a.h") in watcher.files
+        assert watcher.wait(timeout=0.1) == set()
+
+        generate = MockupWriter.generate
+        rendered = []
+        monkeypatch.setattr(MockupWriter, "generate", lambda self, file, part=None: rendered.append(file) or generate(self, file, part))
+        header.write_text(header.read_text() + "/* Nothing to mock */\n")
+        changed = watcher.wait(timeout=5)
+        assert changed == {str(header)}
+        watcher.invalidate(changed)
+        assert Hammock.memo == {}
+        assert watcher.run_once() == 0
+        assert rendered == []  # The declarations did not change
+
+        header.write_text(header.read_text().replace("void c_set_u2(int u2);", "void c_set_u2(long u2);"))
+        watcher.invalidate(watcher.wait(timeout=5))
+        assert watcher.run_once() == 0
+        assert "void c_set_u2(long u2)" in (outdir / "mockup.c").read_text()
+        assert sorted(map(str, rendered)) == ["mockup.c.j2", "mockup.h.j2"]
+        watcher.close()
+
+    def test_failed_run(self, tmp_path, monkeypatch):
+        project = tmp_path / "project"
+        shutil.copytree("tests/data/mini_c_test", project)
+        for name, value in [("translation_units", {}), ("memo", {})]:
+            monkeypatch.setattr(Hammock, name, value)
+        monkeypatch.setattr(MockupWriter, "rendered", {})
+        argv = ["--symbols", "c_set_u2", "--sources", str(project / "b.c"), "--style", "plain_c", f"-I{project / 'includes'}"]
+        watcher = Watcher(argv + ["--outdir", str(tmp_path / "missing")], "poll", interval=0.02)
+        assert watcher.run_once() == 1
+        templates = {str(Path("hammocking/templates/plain_c", name).absolute()) for name in ["mockup.c.j2", "mockup.h.j2"]}
+        assert watcher.files == {str(project / "b.c")} | templates
+
+        watcher.argv = argv + ["--outdir", str(tmp_path)]
+        assert watcher.run_once() == 0
+        assert str(project / "c.h") in watcher.files
+        watcher.argv = argv + ["--outdir", str(tmp_path / "missing")]
+        assert watcher.run_once() == 1
+        assert str(project / "c.h") in watcher.files  # Still watched, although the failed run did not get to read it
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Server mode requires Unix sockets")
+class TestServer:
+    def test_same_result_as_run(self, tmp_path, capsys):
+        """The server gives the same exit code and unresolved symbols as a direct run"""
+        argv = ["--symbols", "a_y1", "c_set_u2", "not_there", "--sources", "tests/data/mini_c_test/b.c",
+                "--outdir", str(tmp_path), "--style", "plain_c", "-Itests/data/mini_c_test/includes"]
+        assert run(list(argv)) == 1
+        expected = capsys.readouterr().err
+        expected_output = (tmp_path / "mockup.c").read_text()
+
+        socket_path = tmp_path / "hammocking.sock"
+        server = Server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            while not socket_path.exists():
+                time.sleep(0.01)
+            for _ in range(2):  # cold and warm
+                (tmp_path / "mockup.c").unlink()
+                response = request(socket_path, {"cwd": os.getcwd(), "argv": argv})
+                assert response["exit"] == 1
+                assert response["stderr"].endswith("HammocKing failed. The following symbols could not be mocked:\nnot_there\n")
+                assert (tmp_path / "mockup.c").read_text() == expected_output
+        finally:
+            request(socket_path, {"command": "shutdown"})
+            thread.join()
+            Hammock.translation_units = None
+        assert expected.endswith("HammocKing failed. The following symbols could not be mocked:\nnot_there\n")
+
+    def test_argument_error(self, tmp_path):
+        root = logging.getLogger()
+        level = root.level
+        assert Server(tmp_path / "unused.sock").handle({"cwd": os.getcwd(), "argv": []})["exit"] == 2
+        assert Server(tmp_path / "unused.sock").handle({"cwd": os.getcwd(), "argv": ["--debug"]})["exit"] == 2
+        assert root.level == level
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets")
+    def test_invalid_requests(self, tmp_path):
+        socket_path = tmp_path / "hammocking.sock"
+        thread = threading.Thread(target=Server(socket_path).serve_forever)
+        thread.start()
+        try:
+            while not socket_path.exists():
+                time.sleep(0.01)
+            assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+            for message in [b"", b"garbage", b"[]", b'{"argv": []}', b'{"cwd": "/not/there", "argv": []}']:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                    connection.connect(str(socket_path))
+                    connection.sendall(message)
+                    connection.shutdown(socket.SHUT_WR)
+                    response = json.loads(connection.makefile("rb").read())
+                assert response["exit"] == 1 and "Invalid request" in response["stderr"]
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:  # Gone before the answer
+                connection.connect(str(socket_path))
+                connection.sendall(b"garbage")
+            assert request(socket_path, {"cwd": os.getcwd(), "argv": []})["exit"] == 2
+        finally:
+            request(socket_path, {"command": "shutdown"})
+            thread.join()
+            Hammock.translation_units = None
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Unix sockets")
+    def test_default_socket_path(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("HAMMOCKING_SOCKET", raising=False)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+        assert Server.default_socket_path() == client_socket_path() == tmp_path / "hammocking.sock"
+        monkeypatch.delenv("XDG_RUNTIME_DIR")
+        assert Server.default_socket_path() == client_socket_path() == Server.private_directory() / "hammocking.sock"
+
+    def test_least_recently_used_translation_units(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Hammock, "translation_units", {})
+        monkeypatch.setattr(Hammock, "max_translation_units", 2)
+        mock = Hammock(set(), [])
+        sources = [tmp_path / name for name in ["a.c", "b.c", "c.c"]]
+        for source in sources:
+            source.write_text("int f(void);\n")
+        first = Hammock.create_translation_unit(mock.parse_options(sources[0]))
+        Hammock.create_translation_unit(mock.parse_options(sources[1]))
+        assert Hammock.create_translation_unit(mock.parse_options(sources[0])) is first
+        Hammock.create_translation_unit(mock.parse_options(sources[2]))
+        assert [Path(key[0]).name for key in Hammock.translation_units] == ["a.c", "c.c"]
+
+
 if __name__ == "__main__":
     unittest.main()